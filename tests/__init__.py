@@ -1,5 +1,12 @@
+import asyncio
+import itertools
 import os
-from typing import Any, List
+from typing import Any, Callable, List, Tuple
+
+from langchain_community.embeddings import FakeEmbeddings
+from vcr.cassette import Cassette
+
+from vcr_langchain.generic import GenericPatch
 
 
 class TemporaryCassettePath:
@@ -19,3 +26,51 @@ class TemporaryCassettePath:
             # remove it for future testing
             if os.path.isfile(self.cassette_path):
                 os.remove(self.cassette_path)
+
+
+TEXTS = ["the earth orbits the sun", "the moon orbits the earth", "bash is a shell"]
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    calls: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return super().embed_query(text)
+
+
+class StatefulPage:
+    """Stand-in for a browser tool whose output changes with every call"""
+
+    counter = itertools.count()
+
+    async def current_page(self) -> str:
+        return f"page {next(self.counter)}"
+
+
+class StatefulPagePatch(GenericPatch):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, StatefulPage, "current_page")
+
+    def get_same_signature_override(self) -> Callable:
+        async def current_page(og_self: StatefulPage) -> str:
+            return await self.generic_override(og_self)
+
+        return current_page
+
+
+async def agent(delay: float) -> Tuple[str, str]:
+    page = StatefulPage()
+    await asyncio.sleep(delay)
+    before = await page.current_page()
+    await asyncio.sleep(delay)
+    after = await page.current_page()
+    return before, after
+
+
+async def fan_out(delays: List[float]) -> List[Tuple[str, str]]:
+    return list(await asyncio.gather(*(agent(delay) for delay in delays)))
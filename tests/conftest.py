@@ -0,0 +1,13 @@
+from typing import Iterator
+
+import pytest
+
+from tests import StatefulPagePatch
+from vcr_langchain.patch import add_patchers, remove_patchers
+
+
+@pytest.fixture
+def stateful_page_patch() -> Iterator[None]:
+    add_patchers(StatefulPagePatch)
+    yield
+    remove_patchers(StatefulPagePatch)
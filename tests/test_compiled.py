@@ -0,0 +1,45 @@
+import shutil
+from pathlib import Path
+
+from langchain_experimental.llm_bash.base import BashProcess
+
+import vcr_langchain as vcr
+from vcr_langchain.compiled import get_cache_path
+
+
+def test_compiled_cassette_is_created_and_reused(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "bash.yaml"
+    shutil.copy("tests/test_use_bash.yaml", cassette_path)
+    cache_path = get_cache_path(cassette_path)
+    assert not cache_path.exists()
+
+    with vcr.use_cassette(str(cassette_path), record_mode=vcr.mode.NONE):
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
+    assert cache_path.is_file()
+
+    compiled_mtime = cache_path.stat().st_mtime_ns
+    with vcr.use_cassette(str(cassette_path), record_mode=vcr.mode.NONE):
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
+    assert cache_path.stat().st_mtime_ns == compiled_mtime
+
+
+def test_stale_compiled_cassette_falls_back_to_yaml(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "bash.yaml"
+    shutil.copy("tests/test_use_bash.yaml", cassette_path)
+    with vcr.use_cassette(str(cassette_path), record_mode=vcr.mode.NONE):
+        BashProcess().run("date")
+
+    cassette_path.write_text(cassette_path.read_text().replace("12:59:50", "13:00:00"))
+    with vcr.use_cassette(str(cassette_path), record_mode=vcr.mode.NONE):
+        assert BashProcess().run("date") == "Tue Jun 13 13:00:00 AEST 2023\n"
+
+
+def test_corrupt_compiled_cassette_is_ignored(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "bash.yaml"
+    shutil.copy("tests/test_use_bash.yaml", cassette_path)
+    cache_path = get_cache_path(cassette_path)
+    cache_path.parent.mkdir()
+    cache_path.write_bytes(b"not a pickle")
+
+    with vcr.use_cassette(str(cassette_path), record_mode=vcr.mode.NONE):
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
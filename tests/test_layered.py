@@ -0,0 +1,69 @@
+import shutil
+from pathlib import Path
+
+import pytest
+import yaml
+from langchain.python import PythonREPL
+from langchain_experimental.llm_bash.base import BashProcess
+
+import vcr_langchain as vcr
+from vcr_langchain.layered import load_base_cassette
+from vcr_langchain.sqlite import SQLitePersister, import_cassettes
+
+BASE_CASSETTE = "tests/test_use_bash.yaml"
+
+
+def test_overlay_falls_through_to_base(tmp_path: Path) -> None:
+    overlay_path = str(tmp_path / "overlay.yaml")
+    with vcr.use_cassette(overlay_path, base_cassettes=[BASE_CASSETTE]):
+        # served by the base cassette...
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
+        # ...while new interactions get recorded into the overlay
+        assert PythonREPL().run(command="print(3 * 3)").strip() == "9"
+
+    with open(overlay_path) as f:
+        interactions = yaml.safe_load(f)["interactions"]
+    assert [i["request"]["uri"] for i in interactions] == ["tool://PythonREPL/run"]
+
+    with vcr.use_cassette(
+        overlay_path, base_cassettes=[BASE_CASSETTE], record_mode=vcr.mode.NONE
+    ):
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
+        assert PythonREPL().run(command="print(3 * 3)").strip() == "9"
+
+
+def test_base_cassette_is_loaded_once() -> None:
+    persister = vcr.default_vcr.persister
+    serializer = vcr.default_vcr._get_serializer("yaml")
+    first = load_base_cassette(BASE_CASSETTE, persister, serializer)
+    second = load_base_cassette(BASE_CASSETTE, persister, serializer)
+    assert first is second
+    assert len(first.interactions) == 1
+
+
+def test_missing_base_cassette_records_into_overlay(tmp_path: Path) -> None:
+    overlay_path = str(tmp_path / "overlay.yaml")
+    missing_base = str(tmp_path / "missing.yaml")
+    with vcr.use_cassette(overlay_path, base_cassettes=[missing_base]):
+        assert PythonREPL().run(command="print(2 + 2)").strip() == "4"
+    assert Path(overlay_path).is_file()
+    assert not Path(missing_base).exists()
+
+
+def test_base_cassette_from_database(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    base_path = tmp_path / BASE_CASSETTE
+    base_path.parent.mkdir()
+    shutil.copy(BASE_CASSETTE, base_path)
+    persister = SQLitePersister(tmp_path / "cassettes.sqlite3")
+    assert import_cassettes(persister, [str(base_path)]) == 1
+    # the base cassette only exists in the database from now on
+    base_path.unlink()
+    monkeypatch.setattr(vcr.default_vcr, "persister", persister)
+
+    overlay_path = str(tmp_path / "overlay.yaml")
+    with vcr.use_cassette(
+        overlay_path, base_cassettes=[str(base_path)], record_mode=vcr.mode.NONE
+    ):
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
@@ -0,0 +1,117 @@
+import shutil
+from pathlib import Path
+from typing import Any, List
+
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_community.llms.fake import FakeListLLM
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.outputs import LLMResult
+from langchain_openai import ChatOpenAI
+
+import vcr_langchain as vcr
+from vcr_langchain.llm_patch import merge_llm_outputs
+
+
+class EndedRuns(BaseCallbackHandler):
+    def __init__(self) -> None:
+        self.results: List[LLMResult] = []
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.results.append(response)
+
+
+def test_replay_chat_model(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "chat.yaml")
+    messages = [HumanMessage(content="How far away is the moon?")]
+    with vcr.use_cassette(cassette_path):
+        recorded = FakeListChatModel(responses=["far", "near"]).batch(
+            [messages, messages + messages]
+        )
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        model = FakeListChatModel(responses=["far", "near"])
+        handler = EndedRuns()
+        replayed = model.batch(
+            [messages, messages + messages], config={"callbacks": [handler]}
+        )
+    assert replayed == recorded
+    assert model.i == 0
+    assert len(handler.results) == 2
+
+
+async def test_replay_llm(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "llm.yaml")
+    with vcr.use_cassette(cassette_path):
+        recorded = await FakeListLLM(responses=["a", "b"]).abatch(["1", "2"])
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        llm = FakeListLLM(responses=["a", "b"])
+        handler = EndedRuns()
+        callbacks: List[BaseCallbackHandler] = [handler]
+        result = llm.generate(["1", "2"], callbacks=callbacks)
+    assert [g[0].text for g in result.generations] == recorded
+    assert llm.i == 0
+    assert [r.generations[0][0].text for r in handler.results] == recorded
+
+
+def test_http_cassettes_still_replay(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "test_chatgpt.yaml"
+    shutil.copy("tests/test_chatgpt.yaml", cassette_path)
+    with vcr.use_cassette(str(cassette_path)):
+        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+        result = llm.invoke(
+            [
+                SystemMessage(
+                    content="Act as a comedian who does not give straightforward "
+                    "responses to anything."
+                ),
+                HumanMessage(content="How far away is the earth from the moon?"),
+            ]
+        )
+    assert isinstance(result.content, str)
+    assert result.content.endswith("always in motion.")
+    # nothing new got recorded into the old cassette
+    assert cassette_path.read_text() == Path("tests/test_chatgpt.yaml").read_text()
+
+
+class BatchRecordingLLM(FakeListLLM):
+    batches: List[List[str]] = []
+
+    def _generate(self, prompts: List[str], *args: Any, **kwargs: Any) -> LLMResult:
+        self.batches.append(prompts)
+        return super()._generate(prompts, *args, **kwargs)
+
+
+def test_batch_only_sends_misses(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "batch.yaml")
+    with vcr.use_cassette(cassette_path):
+        assert BatchRecordingLLM(responses=["a", "b"]).batch(["1", "2"]) == ["a", "b"]
+
+    llm = BatchRecordingLLM(responses=["a", "b"], batches=[])
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NEW_EPISODES):
+        handler = EndedRuns()
+        assert llm.batch(["1", "x", "2", "y"], config={"callbacks": [handler]}) == [
+            "a",
+            "a",
+            "b",
+            "b",
+        ]
+    assert llm.batches == [["x", "y"]]
+    # replayed runs end before the misses are even sent
+    assert [r.generations[0][0].text for r in handler.results] == ["a", "b", "a", "b"]
+
+    llm = BatchRecordingLLM(responses=["a", "b"], batches=[])
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        assert llm.batch(["y", "2", "x", "1"]) == ["b", "b", "a", "a"]
+    assert llm.batches == []
+
+
+def test_merge_llm_outputs() -> None:
+    assert merge_llm_outputs(
+        [
+            {"model_name": "m", "token_usage": {"total_tokens": 3}},
+            None,
+            {"model_name": "m", "token_usage": {"total_tokens": 4}},
+        ]
+    ) == {"model_name": "m", "token_usage": {"total_tokens": 7}}
@@ -0,0 +1,140 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+from langchain.python import PythonREPL
+from langchain_community.vectorstores.faiss import FAISS
+from vcr import VCR
+
+import vcr_langchain as vcr
+from tests import TEXTS, CountingEmbeddings, fan_out
+from vcr_langchain.profiler import (
+    ENDED_HEADER,
+    NESTED_HEADER,
+    STARTED_HEADER,
+    Call,
+    find_critical_path,
+    format_profile,
+    get_label,
+    main,
+    profile_cassette,
+)
+from vcr_langchain.rerecord import count_usage
+from vcr_langchain.sqlite import SQLitePersister
+
+
+def test_recorded_interactions_are_timed(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "timed.yaml")
+    with vcr.use_cassette(cassette_path):
+        PythonREPL().run(command="import time; time.sleep(0.05)")
+
+    with open(cassette_path) as f:
+        headers = yaml.safe_load(f)["interactions"][0]["request"]["headers"]
+    assert headers[ENDED_HEADER][0] - headers[STARTED_HEADER][0] >= 0.05
+
+    # replaying (and re-saving) a cassette keeps the original timings
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE) as cassette:
+        PythonREPL().run(command="import time; time.sleep(0.05)")
+        cassette._save(force=True)
+    with open(cassette_path) as f:
+        assert yaml.safe_load(f)["interactions"][0]["request"]["headers"] == headers
+
+
+def test_plain_vcr_cassettes_are_timed(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "plain.yaml")
+    with VCR().use_cassette(cassette_path):
+        PythonREPL().run(command="print(1)")
+
+    with open(cassette_path) as f:
+        headers = yaml.safe_load(f)["interactions"][0]["request"]["headers"]
+    assert headers[ENDED_HEADER][0] >= headers[STARTED_HEADER][0]
+
+
+def test_critical_path_skips_overlapping_calls() -> None:
+    calls = [
+        Call("a", 0, 1),
+        Call("b", 1, 4),
+        Call("c", 1, 2),
+        Call("d", 4, 5),
+        Call("e", 2, 3),
+    ]
+    assert [c.label for c in find_critical_path(calls)] == ["a", "b", "d"]
+
+
+@pytest.mark.usefixtures("stateful_page_patch")
+async def test_profile_concurrent_run(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "gather.yaml")
+    with vcr.use_cassette(cassette_path):
+        await fan_out([0.0, 0.0, 0.0])
+        await asyncio.sleep(0)
+
+    profile = profile_cassette(cassette_path)
+    assert len(profile.calls) == 6
+    assert profile.time_by_label()["tool:StatefulPage.current_page"][0] == 6
+    assert profile.potential_speedup >= profile.achieved_speedup >= 1
+    assert "Critical path" in format_profile(profile)
+
+
+def test_nested_calls_are_part_of_their_caller(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "nested.yaml")
+    with vcr.use_cassette(cassette_path):
+        store = FAISS.from_texts(TEXTS, CountingEmbeddings(size=8))
+        # the retriever searches the store, which gets recorded as well
+        store.as_retriever().get_relevant_documents("shells")
+
+    with open(cassette_path) as f:
+        interactions = yaml.safe_load(f)["interactions"]
+    nested = [NESTED_HEADER in i["request"]["headers"] for i in interactions]
+    assert len(nested) == 3 and sum(nested) == 1
+
+    profile = profile_cassette(cassette_path)
+    assert sorted(profile.time_by_label()) == [
+        "tool:BaseRetriever.get_relevant_documents",
+        "tool:FAISS.from_texts",
+    ]
+    assert profile.max_concurrency == 1
+    assert profile.achieved_speedup == pytest.approx(1)
+    assert count_usage(cassette_path)["real_requests"] == 2
+
+
+def test_label_model_calls_by_model() -> None:
+    body = {"messages": [], "params": {"model_name": "gpt-4", "temperature": 0}}
+    request = {
+        "uri": "tool://ChatOpenAI/_generate_with_cache",
+        "body": json.dumps(body),
+    }
+    assert get_label(request) == "model:gpt-4"
+    request = {
+        "method": "POST",
+        "uri": "https://api.openai.com/v1/chat/completions",
+        "body": "{}",
+    }
+    assert get_label(request) == "POST api.openai.com/v1/chat/completions"
+    request["body"] = json.dumps({"model": "gpt-4"})
+    assert get_label(request) == "model:gpt-4"
+
+
+def test_profile_cassette_from_database(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    database = str(tmp_path / "cassettes.sqlite3")
+    persister = SQLitePersister(database)
+    monkeypatch.setattr(vcr.default_vcr, "persister", persister)
+    cassette_path = str(tmp_path / "repl.yaml")
+    with vcr.use_cassette(cassette_path):
+        PythonREPL().run(command="print(1)")
+    assert not Path(cassette_path).exists()
+
+    profile = profile_cassette(cassette_path, persister)
+    assert [call.label for call in profile.calls] == ["tool:PythonREPL.run"]
+    assert main([cassette_path, "--database", database]) == 0
+    assert "tool:PythonREPL.run" in capsys.readouterr().out
+
+
+def test_profile_untimed_cassette() -> None:
+    profile = profile_cassette("tests/test_use_bash.yaml")
+    assert profile.calls == []
+    assert profile.potential_speedup == pytest.approx(1)
+    assert "Re-record" in format_profile(profile)
@@ -0,0 +1,123 @@
+import json
+from typing import Iterator, List
+
+import httpx
+import pytest
+
+from vcr_langchain.ratelimit import (
+    RateLimitScheduler,
+    TokenBucket,
+    parse_reset_duration,
+)
+
+
+def make_request(model: str = "gpt-3.5-turbo") -> httpx.Request:
+    return httpx.Request(
+        "POST",
+        "https://api.openai.com/v1/chat/completions",
+        content=json.dumps({"model": model, "messages": []}).encode(),
+    )
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("1s", 1.0), ("6m0s", 360.0), ("20ms", 0.02), ("1h2m", 3720.0), ("7", 7.0)],
+)
+def test_parse_reset_duration(value: str, expected: float) -> None:
+    assert parse_reset_duration(value) == pytest.approx(expected)
+
+
+def test_parse_invalid_reset_duration() -> None:
+    assert parse_reset_duration(None) is None
+    assert parse_reset_duration("soon") is None
+
+
+def test_bucket_queues_reservations_once_exhausted() -> None:
+    bucket = TokenBucket()
+    assert bucket.reserve(1) == 0  # unknown limits never block
+    bucket.update(limit=60, remaining=1, reset=59)
+    assert bucket.reserve(1) == 0
+    first_wait = bucket.reserve(1)
+    second_wait = bucket.reserve(1)
+    assert first_wait == pytest.approx(1, rel=0.1)
+    assert second_wait == pytest.approx(2, rel=0.1)
+
+
+def test_scheduler_retries_rate_limited_requests() -> None:
+    request = make_request()
+    responses = [
+        httpx.Response(
+            429, json={"error": {"message": "Rate limit reached for requests"}}
+        ),
+        httpx.Response(200, json={"choices": []}),
+    ]
+    sleeps: List[float] = []
+    scheduler = RateLimitScheduler(initial_backoff=0.5)
+
+    response = scheduler.send(request, lambda _: responses.pop(0), sleeps.append)
+    assert response.status_code == 200
+    assert not responses
+    assert len(sleeps) == 1 and 0.5 <= sleeps[0] <= 1
+
+
+def test_scheduler_gives_up_after_max_retries() -> None:
+    request = make_request()
+    scheduler = RateLimitScheduler(max_retries=2)
+    sleeps: List[float] = []
+    response = scheduler.send(
+        request,
+        lambda _: httpx.Response(429, headers={"retry-after": "3"}),
+        sleeps.append,
+    )
+    assert response.status_code == 429
+    assert sleeps == [3, 3]
+
+
+def test_scheduler_paces_using_ratelimit_headers() -> None:
+    scheduler = RateLimitScheduler()
+    headers = {
+        "x-ratelimit-limit-requests": "3",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "20s",
+    }
+    sleeps: List[float] = []
+    scheduler.send(
+        make_request(), lambda _: httpx.Response(200, headers=headers), sleeps.append
+    )
+    assert sleeps == []
+
+    scheduler.send(make_request(), lambda _: httpx.Response(200), sleeps.append)
+    # all 3 requests are replenished over 20s
+    assert sleeps == [pytest.approx(20 / 3, rel=0.1)]
+
+    # other models have their own buckets
+    scheduler.send(make_request("gpt-4"), lambda _: httpx.Response(200), sleeps.append)
+    assert len(sleeps) == 1
+
+
+async def test_async_scheduler_retries_rate_limited_requests() -> None:
+    responses = [httpx.Response(429), httpx.Response(200)]
+    sleeps: List[float] = []
+
+    async def send(_: httpx.Request) -> httpx.Response:
+        return responses.pop(0)
+
+    async def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+
+    scheduler = RateLimitScheduler()
+    response = await scheduler.asend(make_request(), send, sleep)
+    assert response.status_code == 200
+    assert len(sleeps) == 1
+
+
+def test_scheduler_does_not_buffer_successful_responses() -> None:
+    def stream() -> Iterator[bytes]:
+        yield b"data: {}\n\n"
+
+    sleeps: List[float] = []
+    response = RateLimitScheduler().send(
+        make_request(), lambda _: httpx.Response(200, content=stream()), sleeps.append
+    )
+    assert not response.is_stream_consumed
+    assert list(response.iter_bytes()) == [b"data: {}\n\n"]
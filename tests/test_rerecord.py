@@ -0,0 +1,164 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+import yaml
+from langchain.python import PythonREPL
+from openai import APIConnectionError
+
+import vcr_langchain as vcr
+from vcr_langchain.rerecord import (
+    PytestError,
+    count_usage,
+    find_cassette_miss,
+    find_stale_cassettes,
+    format_report,
+    rerecord_all,
+)
+
+TEST_FILE_TEMPLATE = """
+from langchain.python import PythonREPL
+
+import vcr_langchain as vcr
+
+
+@vcr.use_cassette({cassette_path!r}, record_mode={record_mode!r})
+def test_python_repl() -> None:
+    assert PythonREPL().run(command="print(6 * 7)").strip() == "42"
+"""
+
+
+def test_find_cassette_miss_through_wrapped_exceptions(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "repl.yaml")
+    with vcr.use_cassette(cassette_path):
+        PythonREPL().run(command="print(1)")
+
+    try:
+        with vcr.use_cassette(cassette_path):
+            try:
+                PythonREPL().run(command="print(2)")
+            except Exception as e:
+                raise APIConnectionError(request=None) from e  # type: ignore
+    except APIConnectionError as e:
+        miss = find_cassette_miss(e)
+    assert miss is not None
+    assert miss.cassette._path == cassette_path
+    assert find_cassette_miss(ValueError()) is None
+
+
+def test_rerecord_stale_cassettes(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "repl.yaml"
+    with vcr.use_cassette(str(cassette_path)):
+        # simulate an outdated cassette recorded with a different command
+        PythonREPL().run(command="print(6 * 9)")
+    test_file = tmp_path / "test_stale.py"
+    test_file.write_text(
+        TEST_FILE_TEMPLATE.format(cassette_path=str(cassette_path), record_mode="once")
+    )
+
+    stale = find_stale_cassettes([str(test_file)])
+    assert [cassette.path for cassette in stale] == [str(cassette_path)]
+    assert stale[0].nodeids == [f"{test_file}::test_python_repl"]
+
+    results = rerecord_all(stale, jobs=2)
+    assert [result.succeeded for result in results] == [True], results[0].output
+    assert results[0].real_requests == 1
+    assert "repl.yaml" in format_report(results)
+
+    with open(cassette_path) as f:
+        interactions = yaml.safe_load(f)["interactions"]
+    assert interactions[0]["request"]["body"] == '{"command": "print(6 * 7)"}'
+    assert find_stale_cassettes([str(test_file)]) == []
+
+
+def test_find_stale_cassettes_ignores_record_mode(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "repl.yaml"
+    with vcr.use_cassette(str(cassette_path)):
+        PythonREPL().run(command="print(6 * 9)")
+    recorded = cassette_path.read_text()
+    test_file = tmp_path / "test_stale.py"
+    test_file.write_text(
+        TEST_FILE_TEMPLATE.format(
+            cassette_path=str(cassette_path), record_mode="new_episodes"
+        )
+    )
+
+    stale = find_stale_cassettes([str(test_file)])
+    assert [cassette.path for cassette in stale] == [str(cassette_path)]
+    assert cassette_path.read_text() == recorded
+
+
+@pytest.mark.parametrize("pytest_args", [["--bogus-flag"], ["does_not_exist.py"]])
+def test_find_stale_cassettes_reports_pytest_errors(pytest_args: List[str]) -> None:
+    with pytest.raises(PytestError, match="pytest exited with code 4"):
+        find_stale_cassettes(pytest_args)
+
+
+FRESH_TEST_FILE = """
+from pathlib import Path
+
+from langchain.python import PythonREPL
+
+import vcr_langchain as vcr
+
+
+def test_record_new_cassette(tmp_path: Path) -> None:
+    with vcr.use_cassette(str(tmp_path / "fresh.yaml")):
+        PythonREPL().run(command="print(1)")
+"""
+
+
+def test_new_cassettes_are_not_stale(tmp_path: Path) -> None:
+    test_file = tmp_path / "test_fresh.py"
+    test_file.write_text(FRESH_TEST_FILE)
+    assert find_stale_cassettes([str(test_file)]) == []
+
+
+SHARED_TEST_FILE = """
+from langchain.python import PythonREPL
+
+import vcr_langchain as vcr
+
+
+@vcr.use_cassette({cassette_path!r})
+def test_up_to_date() -> None:
+    assert PythonREPL().run(command="print(1)").strip() == "1"
+
+
+@vcr.use_cassette({cassette_path!r})
+def test_stale() -> None:
+    assert PythonREPL().run(command="print(6 * 7)").strip() == "42"
+"""
+
+
+def test_rerecord_shared_cassette(tmp_path: Path) -> None:
+    cassette_path = tmp_path / "shared.yaml"
+    with vcr.use_cassette(str(cassette_path)):
+        PythonREPL().run(command="print(1)")
+        PythonREPL().run(command="print(6 * 9)")
+    test_file = tmp_path / "test_shared.py"
+    test_file.write_text(SHARED_TEST_FILE.format(cassette_path=str(cassette_path)))
+
+    stale = find_stale_cassettes([str(test_file)])
+    assert [cassette.path for cassette in stale] == [str(cassette_path)]
+    assert stale[0].nodeids == [
+        f"{test_file}::test_up_to_date",
+        f"{test_file}::test_stale",
+    ]
+    assert len(stale[0].requests) == 1
+
+    results = rerecord_all(stale, jobs=1)
+    assert [result.succeeded for result in results] == [True], results[0].output
+    with open(cassette_path) as f:
+        interactions = yaml.safe_load(f)["interactions"]
+    assert [i["request"]["body"] for i in interactions] == [
+        '{"command": "print(1)"}',
+        '{"command": "print(6 * 7)"}',
+    ]
+
+
+def test_count_usage_of_httpx_cassette() -> None:
+    assert count_usage("tests/test_chatgpt.yaml") == {
+        "real_requests": 1,
+        "total_tokens": 154,
+    }
@@ -0,0 +1,73 @@
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pytest
+from vcr.cassette import Cassette
+
+import vcr_langchain as vcr
+from tests import StatefulPage, agent, fan_out
+from vcr_langchain.generic import GenericPatch
+from vcr_langchain.patch import add_patchers, remove_patchers
+
+
+class NestingPage(StatefulPage):
+    async def describe(self) -> str:
+        # a tool that calls another patched tool along the way
+        return f"{await self.current_page()} via describe"
+
+
+class NestingPagePatch(GenericPatch):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, NestingPage, "describe")
+
+    def get_same_signature_override(self) -> Callable:
+        async def describe(og_self: NestingPage) -> str:
+            return await self.generic_override(og_self)
+
+        return describe
+
+
+@pytest.fixture
+def nesting_page_patch() -> Iterator[None]:
+    add_patchers(NestingPagePatch)
+    yield
+    remove_patchers(NestingPagePatch)
+
+
+pytestmark = pytest.mark.usefixtures("stateful_page_patch")
+
+
+async def test_gathered_tool_calls_replay_by_causal_order(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "gather.yaml")
+    with vcr.use_cassette(cassette_path):
+        # the first agent finishes last while recording...
+        recorded = await fan_out([0.02, 0.0])
+    assert recorded[0] != recorded[1]
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        # ...but first on replay, and still gets its own responses back
+        replayed = await fan_out([0.0, 0.02])
+    assert replayed == recorded
+
+
+async def test_sequential_tool_calls_still_replay(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "sequential.yaml")
+    with vcr.use_cassette(cassette_path):
+        recorded = await agent(0)
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        assert await agent(0) == recorded
+
+
+@pytest.mark.usefixtures("nesting_page_patch")
+async def test_nested_tool_calls_do_not_shift_later_keys(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "nested.yaml")
+    with vcr.use_cassette(cassette_path):
+        page = NestingPage()
+        recorded = (await page.describe(), await page.current_page())
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        page = NestingPage()
+        # the nested call isn't made on replay, and the call after it still gets
+        # its own response back instead of the nested one's
+        assert (await page.describe(), await page.current_page()) == recorded
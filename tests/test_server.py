@@ -0,0 +1,176 @@
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Iterator, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import pytest
+import yaml
+from langchain.prompts.chat import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
+from langchain_experimental.llm_bash.base import BashProcess
+from langchain_openai import ChatOpenAI
+from vcr.persisters.filesystem import FilesystemPersister
+from vcr.serializers import yamlserializer
+
+import vcr_langchain as vcr
+from vcr_langchain.server import (
+    ReplayIndex,
+    ReplayServerPersister,
+    TCPReplayServer,
+    make_server,
+    start_replay_server,
+)
+
+EXPECTED_ENDING = "always in motion."
+
+CLIENT_SCRIPT = """
+import openai
+
+completion = openai.OpenAI().chat.completions.create(
+    model="gpt-3.5-turbo",
+    messages=[
+        {
+            "role": "system",
+            "content": "Act as a comedian who does not give straightforward "
+            "responses to anything.",
+        },
+        {"role": "user", "content": "How far away is the earth from the moon?"},
+    ],
+    n=1,
+    stream=False,
+    temperature=0.0,
+)
+print(completion.choices[0].message.content)
+"""
+
+
+@pytest.fixture
+def replay_server() -> Iterator[Tuple[TCPReplayServer, str]]:
+    server, url = start_replay_server(["tests/"])
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def test_langchain_replays_through_server(
+    replay_server: Tuple[TCPReplayServer, str]
+) -> None:
+    _, url = replay_server
+    chat_prompt = ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(
+                "Act as a comedian who does not give straightforward responses to "
+                "anything."
+            ),
+            HumanMessagePromptTemplate.from_template("{question}"),
+        ]
+    )
+    llm = ChatOpenAI(
+        model="gpt-3.5-turbo",
+        temperature=0,
+        api_key="replay",
+        base_url=f"{url}/v1",
+        max_retries=0,
+    )
+    result = llm.invoke(
+        chat_prompt.format_prompt(
+            question="How far away is the earth from the moon?"
+        ).to_messages()
+    )
+    assert str(result.content).endswith(EXPECTED_ENDING)
+
+
+def test_subprocess_replays_through_server(
+    replay_server: Tuple[TCPReplayServer, str]
+) -> None:
+    _, url = replay_server
+    env = {**os.environ, "OPENAI_BASE_URL": f"{url}/v1", "OPENAI_API_KEY": "replay"}
+    output = subprocess.run(
+        [sys.executable, "-c", CLIENT_SCRIPT],
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.strip().endswith(EXPECTED_ENDING)
+
+
+def test_unrecorded_request_is_a_miss(
+    replay_server: Tuple[TCPReplayServer, str]
+) -> None:
+    _, url = replay_server
+    response = httpx.post(f"{url}/v1/chat/completions", json={"model": "gpt-4"})
+    assert response.status_code == 404
+    assert response.json()["error"]["type"] == "vcr_langchain_replay_miss"
+
+
+def test_serve_compressed_body(replay_server: Tuple[TCPReplayServer, str]) -> None:
+    _, url = replay_server
+    with open("tests/test_use_serp_api.yaml") as f:
+        request = yaml.safe_load(f)["interactions"][0]["request"]
+    parts = urlsplit(request["uri"])
+    response = httpx.get(f"{url}{parts.path}?{parts.query}")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "organic_results" in response.json()
+
+
+def test_skip_files_that_are_not_cassettes() -> None:
+    index = ReplayIndex.load([".pre-commit-config.yaml", "tests/test_chatgpt.yaml"])
+    assert len(index.responses) == 1
+
+
+def test_serve_over_unix_socket(tmp_path: Path) -> None:
+    socket_path = str(tmp_path / "replay.sock")
+    server = make_server(
+        ReplayIndex.load(["tests/test_chatgpt.yaml"]), unix_socket=socket_path
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with httpx.Client(transport=httpx.HTTPTransport(uds=socket_path)) as client:
+            response = client.post("http://replay/v1/completions", json={})
+        assert response.status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    "cassette", ["tests/test_chatgpt.yaml", "tests/test_use_serp_api.yaml"]
+)
+def test_load_cassettes_from_server(
+    replay_server: Tuple[TCPReplayServer, str], cassette: str
+) -> None:
+    _, url = replay_server
+    loaded = ReplayServerPersister(url).load_cassette(cassette, yamlserializer)
+    original = FilesystemPersister.load_cassette(cassette, yamlserializer)
+    assert [r._to_dict() for r in loaded[0]] == [r._to_dict() for r in original[0]]
+    assert loaded[1] == original[1]
+
+
+def test_use_cassettes_from_server(
+    replay_server: Tuple[TCPReplayServer, str],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    server, url = replay_server
+    monkeypatch.setattr(vcr.default_vcr, "persister", ReplayServerPersister(url))
+    # the cassette doesn't need to be on disk for the test to replay it
+    server.index.cassettes[str(tmp_path / "bash.yaml")] = server.index.cassettes[
+        os.path.abspath("tests/test_use_bash.yaml")
+    ]
+    monkeypatch.chdir(tmp_path)
+    with vcr.use_cassette("bash.yaml", record_mode=vcr.mode.NONE) as cassette:
+        assert BashProcess().run("date") == "Tue Jun 13 12:59:50 AEST 2023\n"
+    assert cassette.all_played
+
+    # cassettes the server doesn't know about are recorded to disk as usual
+    with vcr.use_cassette("new.yaml"):
+        assert BashProcess().run("echo hi") == "hi\n"
+    assert (tmp_path / "new.yaml").is_file()
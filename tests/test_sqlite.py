@@ -0,0 +1,97 @@
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+from langchain.python import PythonREPL
+from vcr.persisters.filesystem import FilesystemPersister
+from vcr.request import Request
+from vcr.serializers import yamlserializer
+
+import vcr_langchain as vcr
+from vcr_langchain.sqlite import SQLitePersister, get_fingerprint, main
+
+
+def save_cassettes(database: str, worker: int) -> None:
+    persister = SQLitePersister(database)
+    for i in range(10):
+        request = Request("POST", f"tool://Worker/{worker}", str(i), {})
+        persister.save_cassette(
+            Path(database).parent / f"worker-{worker}-{i}.yaml",
+            {"requests": [request], "responses": [f"response {i}"]},
+            yamlserializer,
+        )
+
+
+def test_import_and_export(tmp_path: Path) -> None:
+    (tmp_path / "tests").mkdir()
+    shutil.copy("tests/test_chatgpt.yaml", tmp_path / "tests")
+    shutil.copy("tests/test_use_bash.yaml", tmp_path / "tests")
+    database = str(tmp_path / "cassettes.sqlite3")
+
+    assert main(["import", database, str(tmp_path / "tests")]) == 0
+    persister = SQLitePersister(database)
+    assert persister.cassette_names() == [
+        "tests/test_chatgpt.yaml",
+        "tests/test_use_bash.yaml",
+    ]
+
+    assert main(["export", database, "--output-dir", str(tmp_path / "out")]) == 0
+    for name in persister.cassette_names():
+        original = FilesystemPersister.load_cassette(tmp_path / name, yamlserializer)
+        exported = FilesystemPersister.load_cassette(
+            tmp_path / "out" / name, yamlserializer
+        )
+        assert [r._to_dict() for r in exported[0]] == [
+            r._to_dict() for r in original[0]
+        ]
+        assert exported[1] == original[1]
+
+
+@pytest.mark.parametrize(
+    "cassette", ["test_use_serp_api.yaml", "test_use_serp_api_without_keyword.yaml"]
+)
+def test_round_trip_binary_bodies(tmp_path: Path, cassette: str) -> None:
+    shutil.copy(f"tests/{cassette}", tmp_path)
+    (tmp_path / "README.yaml").write_text("- not\n- a cassette\n")
+    database = str(tmp_path / "cassettes.sqlite3")
+
+    assert main(["import", database, str(tmp_path)]) == 0
+    persister = SQLitePersister(database)
+    assert persister.cassette_names() == [cassette]
+
+    original = FilesystemPersister.load_cassette(tmp_path / cassette, yamlserializer)
+    loaded = persister.load_cassette(tmp_path / cassette, yamlserializer)
+    assert [r._to_dict() for r in loaded[0]] == [r._to_dict() for r in original[0]]
+    assert loaded[1] == original[1]
+    # the bodies are gzipped, so they only survive as bytes
+    assert isinstance(loaded[1][0]["body"]["string"], bytes)
+
+
+def test_record_and_replay(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    persister = SQLitePersister(tmp_path / "cassettes.sqlite3")
+    monkeypatch.setattr(vcr.default_vcr, "persister", persister)
+    cassette_path = str(tmp_path / "repl.yaml")
+
+    with vcr.use_cassette(cassette_path):
+        recorded = PythonREPL().run(command="print(6 * 7)")
+    assert not Path(cassette_path).exists()
+    assert persister.cassette_names() == ["repl.yaml"]
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE) as cassette:
+        assert PythonREPL().run(command="print(6 * 7)") == recorded
+    assert cassette.all_played
+
+    request = cassette.requests[0]
+    rows = persister.connect().execute(
+        "SELECT cassette FROM interactions WHERE fingerprint = ?",
+        (get_fingerprint(request),),
+    )
+    assert [name for (name,) in rows] == ["repl.yaml"]
+
+
+def test_concurrent_writers(tmp_path: Path) -> None:
+    database = str(tmp_path / "cassettes.sqlite3")
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(save_cassettes, [database] * 4, range(4)))
+    assert len(SQLitePersister(database).cassette_names()) == 40
@@ -0,0 +1,102 @@
+from pathlib import Path
+
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+
+import vcr_langchain as vcr
+from tests import TEXTS, CountingEmbeddings
+
+
+def test_replay_index_and_search(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "faiss.yaml")
+    embeddings = CountingEmbeddings(size=8)
+    with vcr.use_cassette(cassette_path):
+        store = FAISS.from_texts(
+            TEXTS, embeddings, metadatas=[{"i": i} for i in range(3)]
+        )
+        recorded = store.similarity_search_with_score("what orbits the earth?", k=2)
+        recorded_docs = store.as_retriever().get_relevant_documents("shells")
+    assert embeddings.calls > 0
+
+    embeddings = CountingEmbeddings(size=8)
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        store = FAISS.from_texts(
+            TEXTS, embeddings, metadatas=[{"i": i} for i in range(3)]
+        )
+        assert store.index.ntotal == len(TEXTS)
+        assert store.similarity_search_with_score("what orbits the earth?", k=2) == [
+            (doc, float(score)) for doc, score in recorded
+        ]
+        assert store.as_retriever().get_relevant_documents("shells") == recorded_docs
+    assert embeddings.calls == 0
+
+
+async def test_replay_async_retriever(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "faiss-async.yaml")
+    embeddings = CountingEmbeddings(size=8)
+    with vcr.use_cassette(cassette_path):
+        store = await FAISS.afrom_texts(TEXTS, embeddings)
+        recorded = await store.as_retriever().aget_relevant_documents("the moon")
+
+    embeddings = CountingEmbeddings(size=8)
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        store = await FAISS.afrom_texts(TEXTS, embeddings)
+        assert (
+            await store.as_retriever().aget_relevant_documents("the moon") == recorded
+        )
+    assert embeddings.calls == 0
+
+
+def test_missing_calls_pass_through(tmp_path: Path) -> None:
+    embeddings = CountingEmbeddings(size=8)
+    cassette_path = str(tmp_path / "empty.yaml")
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE) as cassette:
+        store = FAISS.from_texts(TEXTS, embeddings)
+        assert len(store.as_retriever().get_relevant_documents("shells")) == 3
+    assert embeddings.calls == 2
+    assert len(cassette) == 0
+
+
+def test_searches_are_keyed_by_documents(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "faiss.yaml")
+    embeddings = CountingEmbeddings(size=8)
+    with vcr.use_cassette(cassette_path):
+        store = FAISS.from_texts(TEXTS, embeddings)
+        store.similarity_search("what orbits the earth?")
+        store.as_retriever().get_relevant_documents("shells")
+
+    other_texts = ["python is a language", "go is a game", "tea is a drink"]
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        other = FAISS.from_texts(other_texts, embeddings)
+        found = other.similarity_search("what orbits the earth?")
+        assert {doc.page_content for doc in found} == set(other_texts)
+        found = other.as_retriever().get_relevant_documents("shells")
+        assert {doc.page_content for doc in found} == set(other_texts)
+
+
+def test_snapshot_keeps_document_ids(tmp_path: Path) -> None:
+    cassette_path = str(tmp_path / "faiss.yaml")
+    with vcr.use_cassette(cassette_path) as cassette:
+        FAISS.from_texts(TEXTS, CountingEmbeddings(size=8), ids=["a", "b", "c"])
+    snapshot = cassette.responses[0]
+    assert [document["id"] for document in snapshot["documents"]] == ["a", "b", "c"]
+
+    with vcr.use_cassette(cassette_path, record_mode=vcr.mode.NONE):
+        store = FAISS.from_texts(TEXTS, CountingEmbeddings(size=8), ids=["a", "b", "c"])
+    assert store.index_to_docstore_id == {0: "a", 1: "b", 2: "c"}
+    assert store.docstore.search("b") == Document(page_content=TEXTS[1])
+
+
+class SubclassedFAISS(FAISS):
+    pass
+
+
+def test_class_attributes_are_restored(tmp_path: Path) -> None:
+    attributes = dict(vars(FAISS))
+    with vcr.use_cassette(str(tmp_path / "unused.yaml")):
+        pass
+    assert dict(vars(FAISS)) == attributes
+    assert isinstance(vars(FAISS)["from_texts"], classmethod)
+
+    store = SubclassedFAISS.from_texts(TEXTS, CountingEmbeddings(size=8))
+    assert type(store) is SubclassedFAISS
@@ -1,8 +1,17 @@
+import os
 from typing import Any, Callable, Dict, List, Union
 
 from vcr import VCR, mode
 
+from .compiled import CompiledCassettePersister
+from .layered import LayeredVCR
 from .patch import get_overridden_build
+from .sequence import headers_without_bookkeeping
+from .server import REPLAY_SERVER_ENV, ReplayServerPersister
+from .sqlite import DATABASE_ENV, SQLitePersister
+
+# environment variable that overrides the default record mode of `use_cassette`
+RECORD_MODE_ENV = "VCR_LANGCHAIN_RECORD_MODE"
 
 
 def scrub_header(unwanted_headers: List[str]) -> Callable:
@@ -18,15 +27,17 @@ def scrub_header(unwanted_headers: List[str]) -> Callable:
             except UnicodeDecodeError:
                 pass  # ignore if we can't parse response
 
+            # responses recorded by patches above the HTTP layer have no headers
+            headers = response.get("headers", {})
             for unwanted_header in unwanted_headers:
-                if unwanted_header in response["headers"]:
-                    response["headers"].pop(unwanted_header)
+                if unwanted_header in headers:
+                    headers.pop(unwanted_header)
         return response
 
     return before_record_response
 
 
-default_vcr = VCR(
+default_vcr = LayeredVCR(
     path_transformer=VCR.ensure_suffix(".yaml"),
     filter_headers=[
         "User-Agent",
@@ -68,12 +79,25 @@ default_vcr = VCR(
         ]
     ),
     match_on=("method", "scheme", "host", "port", "path", "query", "body", "headers"),
-    record_mode=mode.ONCE,
+    record_mode=mode(os.environ.get(RECORD_MODE_ENV, mode.ONCE)),
 )
+if os.environ.get(REPLAY_SERVER_ENV):
+    default_vcr.register_persister(ReplayServerPersister(os.environ[REPLAY_SERVER_ENV]))
+elif os.environ.get(DATABASE_ENV):
+    default_vcr.register_persister(SQLitePersister(os.environ[DATABASE_ENV]))
+else:
+    default_vcr.register_persister(CompiledCassettePersister)
+# requests record their timings and causal order in headers, which are only used to
+# pick between otherwise identical requests
+default_vcr.register_matcher("headers", headers_without_bookkeeping)
 
 use_cassette = default_vcr.use_cassette
 
 
 __all__ = [
+    "CompiledCassettePersister",
+    "LayeredVCR",
+    "ReplayServerPersister",
+    "SQLitePersister",
     "get_overridden_build",
 ]
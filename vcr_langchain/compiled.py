@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import vcr
+from vcr.persisters.filesystem import FilesystemPersister
+from vcr.request import Request
+from vcr.serializers import yamlserializer
+
+log = logging.getLogger(__name__)
+
+# name of the directory that holds compiled cassettes, kept next to the YAML sources
+# in the same spirit as __pycache__
+CACHE_DIR_NAME = "__vcrcache__"
+# bump this whenever the layout of the pickled payload changes
+CACHE_FORMAT_VERSION = 1
+
+
+def _library_version() -> str:
+    try:
+        return metadata.version("vcr-langchain")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def get_cache_key(source: bytes, serializer: Any) -> str:
+    """
+    Key a compiled cassette by everything that could change its deserialized form.
+
+    That is the raw bytes of the source cassette, the serializer used to parse it, and
+    the versions of both this library and vcrpy.
+    """
+    digest = hashlib.sha256(source)
+    for part in (
+        str(CACHE_FORMAT_VERSION),
+        _library_version(),
+        vcr.__version__,
+        getattr(serializer, "__name__", type(serializer).__name__),
+    ):
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_cache_path(cassette_path: Union[str, Path]) -> Path:
+    cassette_path = Path(cassette_path)
+    return cassette_path.parent / CACHE_DIR_NAME / (cassette_path.name + ".pickle")
+
+
+class CompiledCassettePersister:
+    """
+    Persister that keeps a pre-parsed copy of every cassette it loads.
+
+    The YAML cassettes remain the source of truth. The first load of a cassette parses
+    the YAML as usual and pickles the parsed requests and responses into
+    `__vcrcache__/` next to it. Later loads, including those from brand new pytest
+    processes, read the pickle instead so long as its key still matches the source.
+    A stale, missing, or unreadable cache always falls back to the YAML.
+    """
+
+    @classmethod
+    def load_cassette(
+        cls, cassette_path: Union[str, Path], serializer: Any
+    ) -> Tuple[List[Request], List[Any]]:
+        cassette_path = Path(cassette_path)
+        if not cassette_path.is_file():
+            raise ValueError("Cassette not found.")
+        source = cassette_path.read_bytes()
+        key = get_cache_key(source, serializer)
+        cache_path = get_cache_path(cassette_path)
+
+        compiled = cls._read_cache(cache_path, key)
+        if compiled is not None:
+            return compiled
+
+        requests, responses = FilesystemPersister.load_cassette(
+            cassette_path, serializer
+        )
+        cls._write_cache(cache_path, key, requests, responses)
+        return requests, responses
+
+    @staticmethod
+    def save_cassette(
+        cassette_path: Union[str, Path], cassette_dict: Dict[str, Any], serializer: Any
+    ) -> None:
+        # the compiled copy is keyed on the source hash, so it becomes stale on its own
+        # and gets rebuilt the next time this cassette is loaded
+        FilesystemPersister.save_cassette(cassette_path, cassette_dict, serializer)
+
+    @staticmethod
+    def _read_cache(
+        cache_path: Path, key: str
+    ) -> Union[Tuple[List[Request], List[Any]], None]:
+        try:
+            with cache_path.open("rb") as f:
+                payload = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            log.warning("Ignoring unreadable compiled cassette %s", cache_path)
+            return None
+
+        if not isinstance(payload, dict) or payload.get("key") != key:
+            log.info("Compiled cassette %s is stale", cache_path)
+            return None
+        log.info("Loading compiled cassette %s", cache_path)
+        return payload["requests"], payload["responses"]
+
+    @staticmethod
+    def _write_cache(
+        cache_path: Path, key: str, requests: List[Request], responses: List[Any]
+    ) -> None:
+        payload = {"key": key, "requests": requests, "responses": responses}
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # write atomically so that concurrent test processes never see a partially
+            # written cache file
+            fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception:
+            # a read-only checkout should still be able to replay from YAML
+            log.warning("Could not write compiled cassette %s", cache_path)
+
+
+def load_cassettes(
+    paths: Iterable[Union[str, Path]], persister: Optional[Any] = None
+) -> Iterator[Tuple[Path, List[Request], List[Any]]]:
+    """
+    Load every cassette given, and every YAML cassette in the directories given.
+
+    Files that can't be loaded as cassettes are skipped with a warning, since
+    directories can hold other YAML files too, such as CI configuration.
+    """
+    persister = persister or CompiledCassettePersister
+    for path in map(Path, paths):
+        cassettes = sorted(path.rglob("*.yaml")) if path.is_dir() else [path]
+        for cassette in cassettes:
+            try:
+                requests, responses = persister.load_cassette(cassette, yamlserializer)
+            except Exception:
+                log.warning("Skipping unreadable cassette %s", cassette)
+                continue
+            yield cassette, requests, responses
@@ -8,12 +8,21 @@ from vcr.cassette import Cassette
 from vcr.errors import CannotOverwriteExistingCassetteException
 from vcr.request import Request
 
+from .sequence import (
+    SequenceTracker,
+    get_tracker,
+    play_response,
+    running_tool,
+)
+
 log = logging.getLogger(__name__)
 
 LANGCHAIN_VISUALIZER_PATCH_ID = "lc-viz"
 VCR_LANGCHAIN_PATCH_ID = "lc-vcr"
 # override prefix to use if langchain-visualizer is there as well
 VCR_VIZ_INTEROP_PREFIX = "_vcr_"
+# stands in for class attributes that didn't exist before they were patched
+_MISSING = object()
 
 
 def lookup(cassette: Cassette, request: Request) -> Optional[Any]:
@@ -22,11 +31,12 @@ def lookup(cassette: Cassette, request: Request) -> Optional[Any]:
     https://github.com/kevin1024/vcrpy/blob/v4.2.1/vcr/stubs/__init__.py#L225
 
     Because we are running a tool, we exit early compared to the original function
-    because the network reset logic is not needed here.
+    because the network reset logic is not needed here. Out of all matching responses,
+    we prefer the one recorded at the same point in the causal order of tool calls.
     """
     if cassette.can_play_response_for(request):
         log.info("Playing response for {} from cassette".format(request))
-        return cassette.play_response(request)
+        return play_response(cassette, request)
     else:
         if cassette.write_protected and cassette.filter_request(request):
             raise CannotOverwriteExistingCassetteException(
@@ -35,6 +45,23 @@ def lookup(cassette: Cassette, request: Request) -> Optional[Any]:
         return None
 
 
+def lookup_batch(cassette: Cassette, requests: List[Request]) -> List[Optional[Any]]:
+    """
+    Look up every element of a batched call at once.
+
+    Unlike `lookup`, elements missing from a write-protected cassette come back as None
+    instead of failing, so that the caller can decide what to do with the whole batch.
+    """
+    responses = []
+    for request in requests:
+        if cassette.can_play_response_for(request):
+            log.info("Playing response for {} from cassette".format(request))
+            responses.append(play_response(cassette, request))
+        else:
+            responses.append(None)
+    return responses
+
+
 class GenericPatch:
     """
     Generic class for patching into tool overrides
@@ -51,7 +78,14 @@ class GenericPatch:
     generic_override: Callable
     same_signature_override: Callable
     is_async: bool
+    is_classmethod: bool
     blacklisted_args: List[str]
+    sequence: SequenceTracker
+    og_attribute: Any
+    # set this for functions whose own requests get recorded as well. a call that's
+    # missing from a write-protected cassette then runs instead of failing, so that it
+    # can replay from those requests, as in cassettes recorded before the patch existed
+    passes_through_misses: bool = False
 
     def __init__(
         self,
@@ -61,6 +95,7 @@ class GenericPatch:
         blacklisted_args: Optional[List[str]] = None,
     ):
         self.cassette = cassette
+        self.sequence = get_tracker(cassette)
         self.cls = cls
         self.fn_name = fn_name
         self.blacklisted_args = (
@@ -80,6 +115,14 @@ class GenericPatch:
         except AttributeError:
             self.og_fn = getattr(self.cls, self.fn_name)
 
+        # classmethods come back already bound to the class. unwrap them so that they
+        # can be called just like regular methods, with the class in place of self
+        self.is_classmethod = (
+            inspect.ismethod(self.og_fn) and self.og_fn.__self__ is self.cls
+        )
+        if self.is_classmethod:
+            self.og_fn = self.og_fn.__func__  # type: ignore[attr-defined]
+
         self.is_async = inspect.iscoroutinefunction(self.og_fn)
 
         if self.is_async:
@@ -93,7 +136,11 @@ class GenericPatch:
         self.patch = gorilla.Patch(
             destination=self.cls,
             name=override_name,
-            obj=self.same_signature_override,
+            obj=(
+                classmethod(self.same_signature_override)
+                if self.is_classmethod
+                else self.same_signature_override
+            ),
             settings=gorilla.Settings(store_hit=True, allow_hit=not viz_was_here),
         )
 
@@ -108,6 +155,22 @@ class GenericPatch:
         """
         return {}
 
+    def serialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], response: Any
+    ) -> Any:
+        """
+        Override this function if the response can't be stored in a cassette as-is.
+
+        For example, a list of documents can be stored as a list of dicts instead.
+        """
+        return response
+
+    def deserialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], cached_response: Any
+    ) -> Any:
+        """Override this function to undo whatever `serialize_response` did"""
+        return cached_response
+
     def get_request(self, og_self: Any, kwargs: Dict[str, Any]) -> Request:
         """
         Build the request in a consistently repeatable manner.
@@ -130,6 +193,13 @@ class GenericPatch:
             headers=self.get_meta_information(og_self),
         )
 
+    def passes_through(self, request: Request) -> bool:
+        return (
+            self.passes_through_misses
+            and self.cassette.write_protected
+            and not self.cassette.can_play_response_for(request)
+        )
+
     def get_generic_override_fn(self) -> Callable:
         def fn_override(og_self: Any, **kwargs: str) -> Any:
             """
@@ -139,12 +209,19 @@ class GenericPatch:
             serialized properly for caching.
             """
             request = self.get_request(og_self, kwargs)
+            self.sequence.assign_key(request)
+            if self.passes_through(request):
+                with running_tool():
+                    return self.og_fn(og_self, **kwargs)
             cached_response = lookup(self.cassette, request)
             if cached_response is not None:
-                return cached_response
+                return self.deserialize_response(og_self, kwargs, cached_response)
 
-            new_response = self.og_fn(og_self, **kwargs)
-            self.cassette.append(request, new_response)
+            with running_tool():
+                new_response = self.og_fn(og_self, **kwargs)
+            self.cassette.append(
+                request, self.serialize_response(og_self, kwargs, new_response)
+            )
             return new_response
 
         return fn_override
@@ -158,12 +235,19 @@ class GenericPatch:
             serialized properly for caching.
             """
             request = self.get_request(og_self, kwargs)
+            self.sequence.assign_key(request)
+            if self.passes_through(request):
+                with running_tool():
+                    return await self.og_fn(og_self, **kwargs)
             cached_response = lookup(self.cassette, request)
             if cached_response is not None:
-                return cached_response
+                return self.deserialize_response(og_self, kwargs, cached_response)
 
-            new_response = await self.og_fn(og_self, **kwargs)
-            self.cassette.append(request, new_response)
+            with running_tool():
+                new_response = await self.og_fn(og_self, **kwargs)
+            self.cassette.append(
+                request, self.serialize_response(og_self, kwargs, new_response)
+            )
             return new_response
 
         return async_fn_override
@@ -173,7 +257,17 @@ class GenericPatch:
         return self.get_generic_override_fn()
 
     def __enter__(self) -> None:
+        self.sequence.__enter__()
+        # gorilla keeps the original as it was looked up, which turns classmethods
+        # into bound methods, so the class's own attribute is put back by hand
+        self.og_attribute = self.cls.__dict__.get(self.patch.name, _MISSING)
         gorilla.apply(self.patch, id=VCR_LANGCHAIN_PATCH_ID)
 
     def __exit__(self, *_: List[Any]) -> None:
         gorilla.revert(self.patch)
+        if self.og_attribute is _MISSING:
+            if self.patch.name in self.cls.__dict__:
+                delattr(self.cls, self.patch.name)
+        else:
+            setattr(self.cls, self.patch.name, self.og_attribute)
+        self.sequence.__exit__()
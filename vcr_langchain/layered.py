@@ -0,0 +1,155 @@
+import copy
+import functools
+import logging
+import os
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+from vcr import VCR, matchers
+from vcr.cassette import Cassette
+from vcr.matchers import requests_match
+from vcr.record_mode import RecordMode
+from vcr.request import Request
+
+log = logging.getLogger(__name__)
+
+# matchers that, when all used, allow base cassettes to be looked up by index instead
+# of by scanning every interaction
+_INDEXED_MATCHERS = (matchers.method, matchers.host, matchers.path)
+
+
+def _index_key(request: Request) -> Tuple[str, str, str]:
+    return request.method, request.host, request.path
+
+
+class BaseCassette:
+    """
+    A read-only cassette shared by every test that layers on top of it.
+
+    Interactions are indexed by method, host and path so that lookups only need to
+    run the full set of matchers against a handful of candidates.
+    """
+
+    def __init__(self, path: str, interactions: List[Tuple[Request, Any]]) -> None:
+        self.path = path
+        self.interactions = interactions
+        self.index: Dict[Tuple[str, str, str], List[int]] = {}
+        for i, (request, _) in enumerate(interactions):
+            self.index.setdefault(_index_key(request), []).append(i)
+
+    def candidates(self, request: Request, match_on: Sequence[Any]) -> Iterator[int]:
+        if all(matcher in match_on for matcher in _INDEXED_MATCHERS):
+            return iter(self.index.get(_index_key(request), []))
+        return iter(range(len(self.interactions)))
+
+
+_base_cassettes: Dict[Tuple[str, Optional[int], Hashable, Hashable], BaseCassette] = {}
+
+
+def load_base_cassette(path: str, persister: Any, serializer: Any) -> BaseCassette:
+    """
+    Load a base cassette, reusing the copy already in memory if it hasn't changed.
+
+    Cassettes are loaded through the persister, so that base cassettes work with any
+    of them. Those with no file on disk, such as ones kept in a database, can't be
+    checked for changes and are only loaded once.
+    """
+    path = os.path.abspath(path)
+    try:
+        mtime: Optional[int] = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+
+    key = (path, mtime, persister, serializer)
+    if key not in _base_cassettes:
+        try:
+            requests, responses = persister.load_cassette(path, serializer=serializer)
+        except ValueError:
+            # persisters raise this for cassettes that don't exist. that isn't cached,
+            # so that the cassette gets picked up once it's recorded
+            log.warning("Base cassette %s does not exist yet", path)
+            return BaseCassette(path, [])
+        _base_cassettes[key] = BaseCassette(path, list(zip(requests, responses)))
+    return _base_cassettes[key]
+
+
+class LayeredCassette(Cassette):
+    """
+    A cassette that falls back to shared, read-only base cassettes.
+
+    Lookups try this cassette (the overlay) first, then each base cassette in order.
+    Anything that gets recorded only ever goes into the overlay.
+    """
+
+    def __init__(
+        self, *args: Any, base_cassettes: Sequence[str] = (), **kwargs: Any
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.base_cassettes = [
+            load_base_cassette(path, self._persister, self._serializer)
+            for path in base_cassettes
+        ]
+
+    @property
+    def all_played(self) -> bool:
+        return all(self.play_counts[i] for i in range(len(self)))
+
+    def get_interaction(self, index: Hashable) -> Tuple[Request, Any]:
+        if isinstance(index, tuple):
+            layer, i = index
+            request, response = self.base_cassettes[layer].interactions[i]
+            # base cassettes are shared between tests, so don't hand out their data
+            return request, copy.deepcopy(response)
+        return self.data[index]
+
+    def _responses(self, request: Request) -> Iterator[Tuple[Hashable, Any]]:
+        request = self._before_record_request(request)
+        if not request:
+            return
+        # just like with a regular cassette, the overlay's own interactions can only
+        # be played back once they've been loaded from disk
+        if self.rewound:
+            yield from super()._responses(request)
+        for layer, base in enumerate(self.base_cassettes):
+            for i in base.candidates(request, self._match_on):
+                stored_request, _ = base.interactions[i]
+                if requests_match(request, stored_request, self._match_on):
+                    yield (layer, i), self.get_interaction((layer, i))[1]
+
+    def can_play_response_for(self, request: Request) -> bool:
+        # unlike a regular cassette, base cassettes can be played back from before
+        # this one has been loaded from disk
+        filtered_request = self._before_record_request(request)
+        return (
+            bool(filtered_request)
+            and filtered_request in self
+            and self.record_mode != RecordMode.ALL
+        )
+
+
+class LayeredVCR(VCR):
+    """
+    A VCR whose `use_cassette` also accepts a `base_cassettes` list of paths.
+
+    Base cassette paths go through the same path transformer as the cassette itself.
+    """
+
+    def __init__(self, *args: Any, base_cassettes: Sequence[str] = (), **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.base_cassettes = tuple(base_cassettes)
+
+    def _use_cassette(self, with_current_defaults: bool = False, **kwargs: Any) -> Any:
+        if with_current_defaults:
+            return LayeredCassette.use(**self.get_merged_config(**kwargs))
+        args_getter = functools.partial(self.get_merged_config, **kwargs)
+        return LayeredCassette.use_arg_getter(args_getter)
+
+    def get_merged_config(self, **kwargs: Any) -> Dict[str, Any]:
+        merged_config = super().get_merged_config(**kwargs)
+        base_cassettes: Sequence[str] = kwargs.get(
+            "base_cassettes", self.base_cassettes
+        )
+        path_transformer: Optional[Any] = merged_config.get("path_transformer")
+        if path_transformer:
+            base_cassettes = [path_transformer(path) for path in base_cassettes]
+        merged_config["base_cassettes"] = tuple(base_cassettes)
+        return merged_config
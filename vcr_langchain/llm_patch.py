@@ -0,0 +1,356 @@
+"""
+Record what language models generate, above the HTTP layer.
+
+Replaying a generation this way skips building the model's HTTP request, matching it
+against the cassette, and parsing the recorded response. The HTTP requests underneath
+still get recorded whenever a generation is made for real, so cassettes keep working
+with the replay server, and cassettes recorded before these patches existed keep
+replaying over HTTP.
+"""
+import asyncio
+import copy
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel, BaseLLM
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatResult,
+    Generation,
+    LLMResult,
+    RunInfo,
+)
+from vcr.cassette import Cassette
+from vcr.request import Request
+
+from .generic import GenericPatch, lookup_batch
+from .sequence import running_tool
+
+# arguments that only affect callbacks, and not what gets generated
+LLM_BLACKLISTED_ARGS = ["run_manager", "run_managers", "new_arg_supported"]
+
+
+class LanguageModelPatch(GenericPatch):
+    """
+    Records a language model's generations directly, keyed by its parameters and input.
+
+    A call that's missing from a write-protected cassette is passed through instead of
+    failing, so that it can still be replayed from the HTTP requests it was recorded as.
+    """
+
+    input_name: str
+    passes_through_misses = True
+
+    def __init__(self, cassette: Cassette, cls: type, fn_name: str):
+        super().__init__(cassette, cls, fn_name, blacklisted_args=LLM_BLACKLISTED_ARGS)
+
+    def serialize_input(self, value: Any) -> Any:
+        return value
+
+    def get_request(self, og_self: Any, kwargs: Dict[str, Any]) -> Request:
+        filtered_kwargs = {
+            k: v for k, v in kwargs.items() if k not in self.blacklisted_args
+        }
+        filtered_kwargs[self.input_name] = self.serialize_input(
+            filtered_kwargs[self.input_name]
+        )
+        # the model's own parameters, such as its name and temperature
+        filtered_kwargs["params"] = og_self.dict()
+        return Request(
+            method="POST",
+            uri=f"tool://{type(og_self).__name__}/{self.fn_name}",
+            body=json.dumps(filtered_kwargs, sort_keys=True, default=str),
+            headers=self.get_meta_information(og_self),
+        )
+
+
+class ChatModelPatchMixin(LanguageModelPatch):
+    """
+    Records the result of each chat model call.
+
+    `BaseChatModel.generate` calls this once per list of messages, so batches are
+    recorded one element at a time. Callbacks still run on replay, because they run
+    around it.
+    """
+
+    input_name = "messages"
+
+    def __init__(self, cassette: Cassette, fn_name: str):
+        super().__init__(cassette, BaseChatModel, fn_name)
+
+    def serialize_input(self, value: List[BaseMessage]) -> Any:
+        return [message_to_dict(message) for message in value]
+
+    def serialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], response: ChatResult
+    ) -> Dict[str, Any]:
+        return {
+            "generations": [
+                {
+                    "message": message_to_dict(generation.message),
+                    "generation_info": generation.generation_info,
+                }
+                for generation in response.generations
+            ],
+            "llm_output": response.llm_output,
+        }
+
+    def deserialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], cached_response: Dict[str, Any]
+    ) -> ChatResult:
+        return ChatResult(
+            generations=[
+                ChatGeneration(
+                    message=messages_from_dict([generation["message"]])[0],
+                    generation_info=copy.deepcopy(generation["generation_info"]),
+                )
+                for generation in cached_response["generations"]
+            ],
+            llm_output=copy.deepcopy(cached_response["llm_output"]),
+        )
+
+
+class ChatModelPatch(ChatModelPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "_generate_with_cache")
+
+    def get_same_signature_override(self) -> Callable:
+        def _generate_with_cache(
+            og_self: BaseChatModel,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+        ) -> ChatResult:
+            return self.generic_override(
+                og_self, messages=messages, stop=stop, run_manager=run_manager, **kwargs
+            )
+
+        return _generate_with_cache
+
+
+class ChatModelAsyncPatch(ChatModelPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "_agenerate_with_cache")
+
+    def get_same_signature_override(self) -> Callable:
+        async def _agenerate_with_cache(
+            og_self: BaseChatModel,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+        ) -> ChatResult:
+            return await self.generic_override(
+                og_self, messages=messages, stop=stop, run_manager=run_manager, **kwargs
+            )
+
+        return _agenerate_with_cache
+
+
+def merge_llm_outputs(outputs: List[Optional[Dict[str, Any]]]) -> Optional[dict]:
+    """Combine the outputs of several calls, adding up how many tokens they used"""
+    merged: Optional[Dict[str, Any]] = None
+    for output in outputs:
+        if output is None:
+            continue
+        if merged is None:
+            merged = copy.deepcopy(output)
+            continue
+        token_usage = merged.setdefault("token_usage", {})
+        for key, value in (output.get("token_usage") or {}).items():
+            if isinstance(value, (int, float)):
+                token_usage[key] = token_usage.get(key, 0) + value
+    return merged
+
+
+class LLMPatchMixin(LanguageModelPatch):
+    """
+    Records the result for each prompt in a call to a completion model.
+
+    When only some prompts of a batch have been recorded, the rest are sent on as one
+    smaller batch. The original function ends each prompt's run once its result is
+    in, so replaying a result has to end that run too.
+    """
+
+    input_name = "prompts"
+
+    def __init__(self, cassette: Cassette, fn_name: str):
+        super().__init__(cassette, BaseLLM, fn_name)
+
+    def serialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], response: LLMResult
+    ) -> Dict[str, Any]:
+        return {
+            "generations": [
+                [
+                    {"text": g.text, "generation_info": g.generation_info}
+                    for g in generations
+                ]
+                for generations in response.generations
+            ],
+            "llm_output": response.llm_output,
+        }
+
+    def deserialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], cached_response: Dict[str, Any]
+    ) -> LLMResult:
+        return LLMResult(
+            generations=[
+                [Generation(**copy.deepcopy(g)) for g in generations]
+                for generations in cached_response["generations"]
+            ],
+            llm_output=copy.deepcopy(cached_response["llm_output"]),
+        )
+
+    def select(self, kwargs: Dict[str, Any], indices: List[int]) -> Dict[str, Any]:
+        """The arguments for a call with only some of the prompts"""
+        run_managers = kwargs["run_managers"]
+        return {
+            **kwargs,
+            "prompts": [kwargs["prompts"][i] for i in indices],
+            "run_managers": [run_managers[i] for i in indices if i < len(run_managers)],
+        }
+
+    def lookup_prompts(
+        self, og_self: Any, kwargs: Dict[str, Any]
+    ) -> Tuple[List[Request], List[Optional[LLMResult]]]:
+        requests = []
+        for i in range(len(kwargs["prompts"])):
+            request = self.get_request(og_self, self.select(kwargs, [i]))
+            self.sequence.assign_key(request)
+            requests.append(request)
+        results = [
+            None if cached is None else self.deserialize_response(og_self, {}, cached)
+            for cached in lookup_batch(self.cassette, requests)
+        ]
+        return requests, results
+
+    def record_misses(
+        self,
+        og_self: Any,
+        requests: List[Request],
+        results: List[Optional[LLMResult]],
+        misses: List[int],
+        output: LLMResult,
+    ) -> None:
+        for i, flattened in zip(misses, output.flatten()):
+            results[i] = flattened
+            self.cassette.append(
+                requests[i], self.serialize_response(og_self, {}, flattened)
+            )
+
+    def merge(
+        self, kwargs: Dict[str, Any], results: List[Optional[LLMResult]]
+    ) -> LLMResult:
+        complete = [result for result in results if result is not None]
+        output = LLMResult(
+            generations=[result.generations[0] for result in complete],
+            llm_output=merge_llm_outputs([result.llm_output for result in complete]),
+        )
+        if kwargs["run_managers"]:
+            output.run = [RunInfo(run_id=m.run_id) for m in kwargs["run_managers"]]
+        return output
+
+    def get_generic_override_fn(self) -> Callable:
+        def fn_override(og_self: Any, **kwargs: Any) -> LLMResult:
+            requests, results = self.lookup_prompts(og_self, kwargs)
+            misses = [i for i, result in enumerate(results) if result is None]
+            if misses and self.cassette.write_protected:
+                # the batch can only be replayed over HTTP in the same shape that it
+                # was recorded in
+                with running_tool():
+                    return self.og_fn(og_self, **kwargs)
+
+            run_managers = kwargs["run_managers"]
+            for i, result in enumerate(results):
+                if result is not None and i < len(run_managers):
+                    run_managers[i].on_llm_end(result)
+            if misses:
+                with running_tool():
+                    output = self.og_fn(og_self, **self.select(kwargs, misses))
+                self.record_misses(og_self, requests, results, misses, output)
+            return self.merge(kwargs, results)
+
+        return fn_override
+
+    def get_async_generic_override_fn(self) -> Callable:
+        async def async_fn_override(og_self: Any, **kwargs: Any) -> LLMResult:
+            requests, results = self.lookup_prompts(og_self, kwargs)
+            misses = [i for i, result in enumerate(results) if result is None]
+            if misses and self.cassette.write_protected:
+                # the batch can only be replayed over HTTP in the same shape that it
+                # was recorded in
+                with running_tool():
+                    return await self.og_fn(og_self, **kwargs)
+
+            run_managers = kwargs["run_managers"]
+            await asyncio.gather(
+                *[
+                    run_managers[i].on_llm_end(result)
+                    for i, result in enumerate(results)
+                    if result is not None and i < len(run_managers)
+                ]
+            )
+            if misses:
+                with running_tool():
+                    output = await self.og_fn(og_self, **self.select(kwargs, misses))
+                self.record_misses(og_self, requests, results, misses, output)
+            return self.merge(kwargs, results)
+
+        return async_fn_override
+
+
+class LLMPatch(LLMPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "_generate_helper")
+
+    def get_same_signature_override(self) -> Callable:
+        def _generate_helper(
+            og_self: BaseLLM,
+            prompts: List[str],
+            stop: Optional[List[str]],
+            run_managers: List[CallbackManagerForLLMRun],
+            new_arg_supported: bool,
+            **kwargs: Any,
+        ) -> LLMResult:
+            return self.generic_override(
+                og_self,
+                prompts=prompts,
+                stop=stop,
+                run_managers=run_managers,
+                new_arg_supported=new_arg_supported,
+                **kwargs,
+            )
+
+        return _generate_helper
+
+
+class LLMAsyncPatch(LLMPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "_agenerate_helper")
+
+    def get_same_signature_override(self) -> Callable:
+        async def _agenerate_helper(
+            og_self: BaseLLM,
+            prompts: List[str],
+            stop: Optional[List[str]],
+            run_managers: List[AsyncCallbackManagerForLLMRun],
+            new_arg_supported: bool,
+            **kwargs: Any,
+        ) -> LLMResult:
+            return await self.generic_override(
+                og_self,
+                prompts=prompts,
+                stop=stop,
+                run_managers=run_managers,
+                new_arg_supported=new_arg_supported,
+                **kwargs,
+            )
+
+        return _agenerate_helper
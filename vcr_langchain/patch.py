@@ -18,6 +18,7 @@ from vcr.cassette import Cassette
 from vcr.patch import CassettePatcherBuilder
 
 from .generic import GenericPatch
+from .profiler import TimingPatch
 
 log = logging.getLogger(__name__)
 
@@ -29,6 +30,11 @@ def add_patchers(*patchers: Any) -> None:
     CUSTOM_PATCHERS.extend(patchers)
 
 
+def remove_patchers(*patchers: Any) -> None:
+    for patcher in patchers:
+        CUSTOM_PATCHERS.remove(patcher)
+
+
 class PythonREPLPatch(GenericPatch):
     def __init__(self, cassette: Cassette):
         super().__init__(cassette, PythonREPL, "run")
@@ -281,6 +287,7 @@ CassettePatcherBuilder.build = get_overridden_build(CassettePatcherBuilder.build
 # add this after overriding the above build function, to make sure that users of this
 # library can also add their own custom patchers in
 add_patchers(
+    TimingPatch,
     PythonREPLPatch,
     NavigateToolPatch,
     NavigateToolAsyncPatch,
@@ -304,3 +311,38 @@ try:
     add_patchers(BashProcessPatch)
 except ImportError:
     pass
+
+try:
+    from .llm_patch import ChatModelAsyncPatch, ChatModelPatch, LLMAsyncPatch, LLMPatch
+
+    add_patchers(ChatModelPatch, ChatModelAsyncPatch, LLMPatch, LLMAsyncPatch)
+except ImportError:
+    pass
+
+try:
+    from .vectorstore_patch import (
+        FAISSAsyncFromTextsPatch,
+        FAISSAsyncSearchPatch,
+        FAISSFromTextsPatch,
+        FAISSSearchPatch,
+        RetrieverAsyncPatch,
+        RetrieverPatch,
+    )
+
+    add_patchers(
+        FAISSFromTextsPatch,
+        FAISSAsyncFromTextsPatch,
+        FAISSSearchPatch,
+        FAISSAsyncSearchPatch,
+        RetrieverPatch,
+        RetrieverAsyncPatch,
+    )
+except ImportError:
+    pass
+
+try:
+    from .ratelimit import RateLimitPatch
+
+    add_patchers(RateLimitPatch)
+except ImportError:
+    pass
@@ -0,0 +1,291 @@
+"""
+Reconstruct the timeline of an agent run from a cassette, and find where time went.
+
+Usage:
+
+    python -m vcr_langchain.profiler path/to/cassette.yaml [--top N] [--database DB]
+
+Only interactions recorded with timings (that is, with this version of vcr-langchain
+or later) can be profiled. Calls made from inside another recorded call, such as the
+HTTP requests of a model call, are left out, since they're part of that call's time.
+Cassettes are read from the SQLite database in `VCR_LANGCHAIN_DATABASE` if it's set.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from vcr.cassette import Cassette
+from vcr.persisters.filesystem import FilesystemPersister
+from vcr.request import Request
+from vcr.serializers import yamlserializer
+
+from .sequence import ENDED_HEADER, NESTED_HEADER, STARTED_HEADER, in_tool
+from .sqlite import DATABASE_ENV, SQLitePersister
+
+# attribute under which a request keeps its start time until it gets recorded
+_STARTED_ATTRIBUTE = "_vcr_langchain_started"
+
+
+class TimingPatch:
+    """
+    Stamps every interaction recorded into a cassette with when it started and ended.
+
+    The cassette's own methods are wrapped, so this works for any cassette and not just
+    for those of `LayeredVCR`. Interactions made from inside another recorded call are
+    marked as nested instead, since their time is already part of that call's.
+    """
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def can_play_response_for(self, request: Request) -> bool:
+        playable = self.og_can_play_response_for(request)
+        if not playable and not in_tool():
+            # this is checked right before a request is really made, which makes it
+            # the start of the interaction if it ends up getting recorded. keeping it
+            # on the request means that it goes away with requests that never are
+            setattr(request, _STARTED_ATTRIBUTE, time.time())
+        return playable
+
+    def append(self, request: Request, response: Any) -> None:
+        ended = time.time()
+        # interactions being loaded from disk were never looked up, and keep whatever
+        # timings they were recorded with
+        started = getattr(request, _STARTED_ATTRIBUTE, None)
+        length = len(self.cassette.data)
+        self.og_append(request, response)
+        if len(self.cassette.data) == length:
+            return
+        recorded_request = self.cassette.data[-1][0]
+        if in_tool():
+            recorded_request.headers[NESTED_HEADER] = True
+        elif started is not None:
+            recorded_request.headers[STARTED_HEADER] = started
+            recorded_request.headers[ENDED_HEADER] = ended
+
+    def __enter__(self) -> None:
+        self.og_can_play_response_for = self.cassette.can_play_response_for
+        self.og_append = self.cassette.append
+        self.cassette.can_play_response_for = self.can_play_response_for  # type: ignore
+        self.cassette.append = self.append  # type: ignore
+
+    def __exit__(self, *_: Any) -> None:
+        del self.cassette.can_play_response_for
+        del self.cassette.append
+
+
+@dataclass
+class Call:
+    label: str
+    started: float
+    ended: float
+
+    @property
+    def duration(self) -> float:
+        return self.ended - self.started
+
+
+@dataclass
+class Profile:
+    calls: List[Call]
+    critical_path: List[Call] = field(default_factory=list)
+
+    @property
+    def wall_time(self) -> float:
+        if not self.calls:
+            return 0.0
+        return max(c.ended for c in self.calls) - min(c.started for c in self.calls)
+
+    @property
+    def serial_time(self) -> float:
+        """How long all calls would have taken one after another"""
+        return sum(c.duration for c in self.calls)
+
+    @property
+    def busy_time(self) -> float:
+        """How long at least one call was running"""
+        total = 0.0
+        covered_until = float("-inf")
+        for call in sorted(self.calls, key=lambda c: c.started):
+            start = max(call.started, covered_until)
+            if call.ended > start:
+                total += call.ended - start
+            covered_until = max(covered_until, call.ended)
+        return total
+
+    @property
+    def critical_path_time(self) -> float:
+        return sum(c.duration for c in self.critical_path)
+
+    @property
+    def achieved_speedup(self) -> float:
+        """How much faster the calls ran than they would have with no concurrency"""
+        return self.serial_time / self.busy_time if self.busy_time else 1.0
+
+    @property
+    def potential_speedup(self) -> float:
+        """
+        Upper bound on the speedup from concurrency.
+
+        This is what running every call off the critical path alongside it would give.
+        """
+        if not self.critical_path_time:
+            return 1.0
+        return self.serial_time / self.critical_path_time
+
+    @property
+    def max_concurrency(self) -> int:
+        events = sorted(
+            [(c.started, 1) for c in self.calls] + [(c.ended, -1) for c in self.calls]
+        )
+        running = peak = 0
+        for _, change in events:
+            running += change
+            peak = max(peak, running)
+        return peak
+
+    def time_by_label(self) -> Dict[str, List[float]]:
+        totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        for call in self.calls:
+            totals[call.label][0] += 1
+            totals[call.label][1] += call.duration
+        return dict(totals)
+
+
+def _header(headers: Dict[str, Any], name: str) -> Optional[float]:
+    for key, value in headers.items():
+        if key.lower() == name:
+            if isinstance(value, list):
+                value = value[0] if value else None
+            return None if value is None else float(value)
+    return None
+
+
+def get_label(request: Dict[str, Any]) -> str:
+    """Label a call by the model it asked for, or by its tool class and function"""
+    uri = urlparse(request.get("uri", ""))
+    try:
+        body = json.loads(request.get("body") or "{}")
+    except (TypeError, ValueError):
+        body = None
+    if not isinstance(body, dict):
+        body = {}
+    if uri.scheme == "tool":
+        # model calls recorded as a whole are tool calls that carry the model's
+        # parameters along
+        params = body.get("params")
+        model = (
+            (params.get("model_name") or params.get("model"))
+            if isinstance(params, dict)
+            else None
+        )
+        if model:
+            return f"model:{model}"
+        return f"tool:{uri.netloc}{uri.path.replace('/', '.')}"
+    if body.get("model"):
+        return f"model:{body['model']}"
+    return f"{request.get('method', 'GET')} {uri.netloc}{uri.path}"
+
+
+def find_critical_path(calls: Sequence[Call]) -> List[Call]:
+    """
+    Find the longest chain of calls where each one starts after the previous one ended.
+
+    Any call that started after another one ended could have depended on it, so this
+    chain is what bounds the run time no matter how much else is made concurrent.
+    """
+    ordered = sorted(calls, key=lambda c: c.ended)
+    best: List[float] = []
+    previous: List[Optional[int]] = []
+    for i, call in enumerate(ordered):
+        best.append(call.duration)
+        previous.append(None)
+        for j in range(i):
+            if ordered[j].ended <= call.started and best[j] + call.duration > best[i]:
+                best[i] = best[j] + call.duration
+                previous[i] = j
+    if not ordered:
+        return []
+    index: Optional[int] = max(range(len(ordered)), key=best.__getitem__)
+    path = []
+    while index is not None:
+        path.append(ordered[index])
+        index = previous[index]
+    return path[::-1]
+
+
+def profile_cassette(
+    cassette_path: str, persister: Any = FilesystemPersister
+) -> Profile:
+    requests, _ = persister.load_cassette(cassette_path, serializer=yamlserializer)
+    calls = []
+    for request in (r._to_dict() for r in requests):
+        headers = request.get("headers") or {}
+        if _header(headers, NESTED_HEADER):
+            continue
+        started = _header(headers, STARTED_HEADER)
+        ended = _header(headers, ENDED_HEADER)
+        if started is None or ended is None:
+            continue
+        calls.append(Call(get_label(request), started, ended))
+    calls.sort(key=lambda c: c.started)
+    return Profile(calls, find_critical_path(calls))
+
+
+def format_profile(profile: Profile, top: int = 10) -> str:
+    if not profile.calls:
+        return "No timed interactions found. Re-record the cassette to profile it."
+    origin = profile.calls[0].started
+    lines = [
+        f"{len(profile.calls)} calls over {profile.wall_time:.2f}s, "
+        f"{profile.busy_time:.2f}s spent waiting on calls, "
+        f"{profile.serial_time:.2f}s if run serially, "
+        f"up to {profile.max_concurrency} at once",
+        "",
+        f"Critical path ({profile.critical_path_time:.2f}s):",
+    ]
+    for call in profile.critical_path:
+        lines.append(
+            f"  {call.started - origin:>8.2f}s  {call.duration:>8.2f}s  {call.label}"
+        )
+    lines += ["", "Time by tool and model:"]
+    by_label = sorted(profile.time_by_label().items(), key=lambda kv: -kv[1][1])
+    for label, (count, total) in by_label[:top]:
+        lines.append(f"  {total:>8.2f}s  {int(count):>5} calls  {label}")
+    lines += [
+        "",
+        f"Speedup from concurrency: {profile.achieved_speedup:.2f}x achieved, "
+        f"up to {profile.potential_speedup:.2f}x possible",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vcr_langchain.profiler",
+        description="Profile an agent run from its recorded cassette.",
+    )
+    parser.add_argument("cassette", help="path to the cassette to profile")
+    parser.add_argument(
+        "--top", type=int, default=10, help="number of tools and models to list"
+    )
+    parser.add_argument(
+        "--database",
+        default=os.environ.get(DATABASE_ENV),
+        help=f"SQLite database to read the cassette from (default: ${DATABASE_ENV})",
+    )
+    args = parser.parse_args(argv)
+    persister = SQLitePersister(args.database) if args.database else FilesystemPersister
+    profile = profile_cassette(args.cassette, persister)
+    print(format_profile(profile, top=args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import gorilla
+import httpx
+from vcr.cassette import Cassette
+
+from .generic import VCR_LANGCHAIN_PATCH_ID
+
+log = logging.getLogger(__name__)
+
+RATE_LIMIT_MESSAGE = "Rate limit reached for"
+# OpenAI's rule of thumb for English text, used to estimate the token cost of a request
+# before it is sent
+CHARS_PER_TOKEN = 4
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse an OpenAI reset header such as "1s", "6m0s" or "20ms" into seconds.
+
+    Returns None if the value is missing or unparseable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+class TokenBucket:
+    """
+    Token bucket whose state is corrected by the rate limit headers of each response.
+
+    Reservations may drive the bucket negative. That is what queues callers: each
+    reservation returns how long the caller must wait for its share to refill.
+    """
+
+    capacity: float
+    tokens: float
+    refill_rate: float
+    updated_at: float
+
+    def __init__(self, capacity: float = 0, refill_rate: float = 0) -> None:
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refill_rate = refill_rate
+        self.updated_at = time.monotonic()
+
+    @property
+    def is_known(self) -> bool:
+        return self.capacity > 0 and self.refill_rate > 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+
+    def update(
+        self, limit: Optional[float], remaining: Optional[float], reset: Optional[float]
+    ) -> None:
+        """Resynchronize with the limits the server just reported"""
+        if limit is None or remaining is None or limit <= 0:
+            return
+        was_known = self.is_known
+        self._refill(time.monotonic())
+        self.capacity = limit
+        if reset and reset > 0 and remaining < limit:
+            self.refill_rate = (limit - remaining) / reset
+        elif not self.refill_rate:
+            # OpenAI limits are expressed per minute
+            self.refill_rate = limit / 60.0
+        # once known, never trust the server more than our own outstanding reservations
+        self.tokens = min(self.tokens, remaining) if was_known else remaining
+
+    def reserve(self, cost: float) -> float:
+        """Take `cost` tokens and return how many seconds to wait before using them"""
+        if not self.is_known:
+            return 0.0
+        now = time.monotonic()
+        self._refill(now)
+        # a single request larger than the whole bucket can only wait for a full one
+        cost = min(cost, self.capacity)
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_rate
+
+
+class RateLimitScheduler:
+    """
+    Paces and retries real requests made while recording.
+
+    Buckets are kept per (host, model) for both requests and tokens, and are updated
+    from the `x-ratelimit-*` response headers before `scrub_header` strips them from
+    the cassette. Rate-limited responses are retried with exponential backoff rather
+    than being handed back to the caller.
+    """
+
+    max_retries: int
+    initial_backoff: float
+    max_backoff: float
+
+    def __init__(
+        self,
+        max_retries: int = 6,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.buckets: Dict[Tuple[str, Optional[str]], Dict[str, TokenBucket]] = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, request: httpx.Request) -> Tuple[str, Optional[str]]:
+        model = None
+        try:
+            body = json.loads(request.content or b"{}")
+            if isinstance(body, dict) and isinstance(body.get("model"), str):
+                model = body["model"]
+        except (ValueError, UnicodeDecodeError, httpx.RequestNotRead):
+            pass
+        return request.url.host, model
+
+    def estimate_tokens(self, request: httpx.Request) -> float:
+        try:
+            content = request.content
+        except httpx.RequestNotRead:
+            return 1
+        estimate = len(content) / CHARS_PER_TOKEN
+        try:
+            body = json.loads(content or b"{}")
+            if isinstance(body, dict) and isinstance(body.get("max_tokens"), int):
+                estimate += body["max_tokens"]
+        except (ValueError, UnicodeDecodeError):
+            pass
+        return max(estimate, 1)
+
+    def _get_buckets(self, key: Tuple[str, Optional[str]]) -> Dict[str, TokenBucket]:
+        if key not in self.buckets:
+            self.buckets[key] = {"requests": TokenBucket(), "tokens": TokenBucket()}
+        return self.buckets[key]
+
+    def reserve(self, request: httpx.Request) -> float:
+        """Reserve capacity for a request and return how long to wait before sending"""
+        with self.lock:
+            buckets = self._get_buckets(self.get_key(request))
+            return max(
+                buckets["requests"].reserve(1),
+                buckets["tokens"].reserve(self.estimate_tokens(request)),
+            )
+
+    def observe(self, request: httpx.Request, response: httpx.Response) -> None:
+        """Update the buckets for this request from the response headers"""
+        headers = response.headers
+
+        def number(name: str) -> Optional[float]:
+            try:
+                return float(headers[name])
+            except (KeyError, ValueError):
+                return None
+
+        with self.lock:
+            buckets = self._get_buckets(self.get_key(request))
+            for kind in ("requests", "tokens"):
+                buckets[kind].update(
+                    number(f"x-ratelimit-limit-{kind}"),
+                    number(f"x-ratelimit-remaining-{kind}"),
+                    parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+                )
+
+    def is_rate_limited(self, response: httpx.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        # some rate limit errors don't come with the proper status code
+        return response.status_code >= 400 and RATE_LIMIT_MESSAGE in response.text
+
+    def get_backoff(self, response: httpx.Response, attempt: int) -> float:
+        retry_after = parse_reset_duration(response.headers.get("retry-after"))
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        backoff = self.initial_backoff * (2**attempt)
+        # jitter so that queued workers don't all retry at the same instant
+        return min(backoff * (1 + random.random()), self.max_backoff)
+
+    def send(
+        self,
+        request: httpx.Request,
+        real_send: Callable[[httpx.Request], httpx.Response],
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            wait = self.reserve(request)
+            if wait > 0:
+                log.info("Waiting %.2fs for rate limit on %s", wait, request.url)
+                sleep(wait)
+            response = real_send(request)
+            self.observe(request, response)
+            if attempt >= self.max_retries or response.status_code < 400:
+                return response
+            # only error responses are read here, so that successful ones (which may
+            # be streamed) reach the caller unbuffered
+            response.read()
+            if not self.is_rate_limited(response):
+                return response
+            backoff = self.get_backoff(response, attempt)
+            log.warning("Rate limited on %s, retrying in %.2fs", request.url, backoff)
+            response.close()
+            sleep(backoff)
+            attempt += 1
+
+    async def asend(
+        self,
+        request: httpx.Request,
+        real_send: Callable[[httpx.Request], Awaitable[httpx.Response]],
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            wait = self.reserve(request)
+            if wait > 0:
+                log.info("Waiting %.2fs for rate limit on %s", wait, request.url)
+                await sleep(wait)
+            response = await real_send(request)
+            self.observe(request, response)
+            if attempt >= self.max_retries or response.status_code < 400:
+                return response
+            # only error responses are read here, so that successful ones (which may
+            # be streamed) reach the caller unbuffered
+            await response.aread()
+            if not self.is_rate_limited(response):
+                return response
+            backoff = self.get_backoff(response, attempt)
+            log.warning("Rate limited on %s, retrying in %.2fs", request.url, backoff)
+            await response.aclose()
+            await sleep(backoff)
+            attempt += 1
+
+
+default_scheduler = RateLimitScheduler()
+
+
+class RateLimitPatch:
+    """
+    Patches the httpx transports so that requests go through the scheduler.
+
+    vcrpy stubs out `httpx.Client.send`, and only calls down to the transport when a
+    request actually needs to be recorded. Patching one level lower means replayed
+    requests are never throttled.
+    """
+
+    scheduler: RateLimitScheduler = default_scheduler
+    # the transports are global, so only the outermost cassette patches them
+    active_count = 0
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        og_send = httpx.HTTPTransport.handle_request
+        og_asend = httpx.AsyncHTTPTransport.handle_async_request
+
+        def handle_request(
+            og_self: httpx.HTTPTransport, request: httpx.Request
+        ) -> httpx.Response:
+            return self.scheduler.send(request, lambda r: og_send(og_self, r))
+
+        async def handle_async_request(
+            og_self: httpx.AsyncHTTPTransport, request: httpx.Request
+        ) -> httpx.Response:
+            return await self.scheduler.asend(request, lambda r: og_asend(og_self, r))
+
+        settings = gorilla.Settings(allow_hit=True, store_hit=True)
+        self.patches: List[gorilla.Patch] = [
+            gorilla.Patch(
+                httpx.HTTPTransport, "handle_request", handle_request, settings
+            ),
+            gorilla.Patch(
+                httpx.AsyncHTTPTransport,
+                "handle_async_request",
+                handle_async_request,
+                settings,
+            ),
+        ]
+
+    def __enter__(self) -> None:
+        if RateLimitPatch.active_count == 0:
+            for patch in self.patches:
+                gorilla.apply(patch, id=VCR_LANGCHAIN_PATCH_ID)
+        RateLimitPatch.active_count += 1
+
+    def __exit__(self, *_: List[Any]) -> None:
+        RateLimitPatch.active_count -= 1
+        if RateLimitPatch.active_count == 0:
+            for patch in self.patches:
+                gorilla.revert(patch)
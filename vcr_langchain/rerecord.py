@@ -0,0 +1,338 @@
+"""
+Find cassettes that no longer match what the code sends, and re-record only those.
+
+Usage:
+
+    python -m vcr_langchain.rerecord [--jobs N] [--dry-run] [pytest args...]
+
+This first replays the selected tests without allowing any recording, and notes every
+test that fails because its cassette has no match for a request. The cassettes of
+those tests are then re-recorded in parallel, each in its own pytest process that runs
+every selected test using that cassette. Cassettes that didn't exist before the test
+ran, such as ones in temporary directories, are never considered stale.
+
+This module doubles as the pytest plugin that the spawned pytest processes load in
+order to report cassette misses back.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional, Sequence
+
+import pytest
+import yaml
+from vcr.cassette import Cassette
+from vcr.errors import CannotOverwriteExistingCassetteException
+from vcr.record_mode import RecordMode
+
+from . import RECORD_MODE_ENV
+from .sequence import NESTED_HEADER
+
+PLUGIN_NAME = "vcr_langchain.rerecord"
+# environment variable for the file that pytest processes report cassette misses to
+MISSES_FILE_ENV = "VCR_LANGCHAIN_MISSES_FILE"
+# pytest exit codes for all tests passing, and for some of them failing
+PYTEST_OK_EXIT_CODES = (0, 1)
+
+
+class PytestError(RuntimeError):
+    """Pytest couldn't run the tests at all, for example because of a bad argument"""
+
+
+def find_cassette_miss(
+    exception: Optional[BaseException],
+) -> Optional[CannotOverwriteExistingCassetteException]:
+    """
+    Find the cassette miss behind an exception, if there is one.
+
+    Client libraries such as openai wrap the vcrpy exception in their own, so the
+    whole chain of causes needs to be searched.
+    """
+    seen = set()
+    while exception is not None and id(exception) not in seen:
+        if isinstance(exception, CannotOverwriteExistingCassetteException):
+            return exception
+        seen.add(id(exception))
+        exception = exception.__cause__ or exception.__context__
+    return None
+
+
+# node ID of the test that's running, for attributing the cassettes it uses
+_current_nodeid: Optional[str] = None
+
+
+def _get_nodeid(item: pytest.Item) -> str:
+    # make the node ID independent of the rootdir so that it can be run from anywhere
+    return "::".join([str(item.path), *item.nodeid.split("::")[1:]])
+
+
+def _report(entry: Dict[str, Any]) -> None:
+    with open(os.environ[MISSES_FILE_ENV], "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    if not os.environ.get(MISSES_FILE_ENV):
+        return
+    # the record mode environment variable only changes the default, and tests that
+    # pass their own record mode must not record while looking for stale cassettes
+    og_init = Cassette.__init__
+
+    def __init__(self: Cassette, *args: Any, **kwargs: Any) -> None:
+        og_init(self, *args, **kwargs)
+        self.record_mode = RecordMode.NONE
+        if _current_nodeid is not None:
+            # every test using a cassette has to be rerun to re-record it, or the
+            # interactions of the tests that aren't would be lost
+            _report(
+                {
+                    "nodeid": _current_nodeid,
+                    "cassette": os.path.abspath(str(self._path)),
+                }
+            )
+
+    Cassette.__init__ = __init__  # type: ignore[method-assign]
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item: pytest.Item, nextitem: Any) -> Generator:
+    global _current_nodeid
+    _current_nodeid = _get_nodeid(item)
+    try:
+        yield
+    finally:
+        _current_nodeid = None
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item: pytest.Item, call: Any) -> Generator:
+    yield
+    if not os.environ.get(MISSES_FILE_ENV) or call.excinfo is None:
+        return
+    miss = find_cassette_miss(call.excinfo.value)
+    # cassettes that weren't there before the test ran, such as ones recorded into a
+    # temporary directory, can't be stale
+    if miss is None or not miss.cassette.rewound:
+        return
+    _report(
+        {
+            "nodeid": _get_nodeid(item),
+            "cassette": os.path.abspath(str(miss.cassette._path)),
+            "request": repr(miss.failed_request),
+        }
+    )
+
+
+@dataclass
+class StaleCassette:
+    path: str
+    nodeids: List[str] = field(default_factory=list)
+    requests: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RerecordResult:
+    cassette: StaleCassette
+    succeeded: bool
+    seconds: float
+    real_requests: int = 0
+    total_tokens: int = 0
+    output: str = ""
+
+
+def _run_pytest(
+    pytest_args: Sequence[str], env: Dict[str, str]
+) -> "subprocess.CompletedProcess[str]":
+    return subprocess.run(
+        [sys.executable, "-m", "pytest", "-p", PLUGIN_NAME, *pytest_args],
+        env={**os.environ, **env},
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+
+def find_stale_cassettes(pytest_args: Sequence[str]) -> List[StaleCassette]:
+    """
+    Replay the selected tests without recording, and collect the cassette misses.
+
+    Raises `PytestError` if pytest exits with anything other than passing or failing
+    tests, such as on a collection error or a bad argument.
+    """
+    fd, misses_file = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    try:
+        completed = _run_pytest(
+            ["-q", "-p", "no:cacheprovider", *pytest_args],
+            {MISSES_FILE_ENV: misses_file, RECORD_MODE_ENV: "none"},
+        )
+        if completed.returncode not in PYTEST_OK_EXIT_CODES:
+            raise PytestError(
+                f"pytest exited with code {completed.returncode}:\n"
+                f"{completed.stdout}"
+            )
+        with open(misses_file) as f:
+            misses = [json.loads(line) for line in f if line.strip()]
+    finally:
+        os.remove(misses_file)
+
+    stale: Dict[str, StaleCassette] = {}
+    for miss in misses:
+        if "request" in miss:
+            cassette = stale.setdefault(
+                miss["cassette"], StaleCassette(miss["cassette"])
+            )
+            cassette.requests.append(miss["request"])
+    # rerun every selected test that uses a stale cassette, and not only those that
+    # missed, since the cassette gets recorded from scratch
+    for use in misses:
+        nodeids = stale[use["cassette"]].nodeids if use["cassette"] in stale else None
+        if nodeids is not None and use["nodeid"] not in nodeids:
+            nodeids.append(use["nodeid"])
+    return list(stale.values())
+
+
+def count_usage(cassette_path: str) -> Dict[str, int]:
+    """
+    Count the calls and the OpenAI tokens that a cassette recorded.
+
+    Requests made from inside another recorded call, such as the HTTP requests of a
+    model call that's also recorded as a whole, are part of that call and don't count
+    again. Their tokens do, since only the HTTP responses report them.
+    """
+    with open(cassette_path) as f:
+        data = yaml.safe_load(f) or {}
+    real_requests = 0
+    total_tokens = 0
+    for interaction in data.get("interactions", []):
+        headers = (interaction.get("request") or {}).get("headers") or {}
+        if NESTED_HEADER not in {key.lower() for key in headers}:
+            real_requests += 1
+        response = interaction.get("response")
+        if not isinstance(response, dict):
+            continue
+        try:
+            # httpx responses, as made by openai>=1, are recorded under "content"
+            if "content" in response:
+                body = json.loads(response["content"])
+            else:
+                body = json.loads(response["body"]["string"])
+            total_tokens += body["usage"]["total_tokens"]
+        except (KeyError, TypeError, ValueError):
+            continue
+    return {"real_requests": real_requests, "total_tokens": total_tokens}
+
+
+def rerecord(cassette: StaleCassette) -> RerecordResult:
+    """
+    Re-record a single cassette by running every test that uses it with it removed.
+
+    The old cassette is restored if recording fails.
+    """
+    backup_path = cassette.path + ".bak"
+    if os.path.exists(cassette.path):
+        shutil.move(cassette.path, backup_path)
+    start = time.perf_counter()
+    # only run the tests that use the cassette, even if the original selection was
+    # wider
+    # the first test to use the cassette creates it, and the rest have to be able to
+    # add to it
+    completed = _run_pytest(
+        ["-q", *cassette.nodeids], {RECORD_MODE_ENV: RecordMode.NEW_EPISODES.value}
+    )
+    seconds = time.perf_counter() - start
+
+    succeeded = completed.returncode == 0 and os.path.exists(cassette.path)
+    if succeeded:
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        return RerecordResult(
+            cassette,
+            True,
+            seconds,
+            output=completed.stdout,
+            **count_usage(cassette.path),
+        )
+
+    if os.path.exists(backup_path):
+        shutil.move(backup_path, cassette.path)
+    return RerecordResult(cassette, False, seconds, output=completed.stdout)
+
+
+def rerecord_all(cassettes: Sequence[StaleCassette], jobs: int) -> List[RerecordResult]:
+    # each re-recording already runs in its own pytest process, so threads are enough
+    # to bound how many of those processes run at once
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(rerecord, cassettes))
+
+
+def format_report(results: Sequence[RerecordResult]) -> str:
+    lines = [f"{'status':<8}{'seconds':>9}{'requests':>10}{'tokens':>10}  cassette"]
+    for result in results:
+        status = "ok" if result.succeeded else "FAILED"
+        lines.append(
+            f"{status:<8}{result.seconds:>9.1f}{result.real_requests:>10}"
+            f"{result.total_tokens:>10}  {os.path.relpath(result.cassette.path)}"
+        )
+    lines.append(
+        f"{'total':<8}{sum(r.seconds for r in results):>9.1f}"
+        f"{sum(r.real_requests for r in results):>10}"
+        f"{sum(r.total_tokens for r in results):>10}"
+    )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vcr_langchain.rerecord",
+        description="Re-record only the cassettes that no longer match the code.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="maximum number of cassettes to re-record at once",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only list the stale cassettes without re-recording them",
+    )
+    args, pytest_args = parser.parse_known_args(argv)
+
+    try:
+        stale = find_stale_cassettes(pytest_args)
+    except PytestError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not stale:
+        print("All cassettes are up to date.")
+        return 0
+    for cassette in stale:
+        print(f"{os.path.relpath(cassette.path)} is stale, used by:")
+        for nodeid in cassette.nodeids:
+            print(f"    {nodeid}")
+    if args.dry_run:
+        return 1
+
+    results = rerecord_all(stale, max(args.jobs, 1))
+    for result in results:
+        if not result.succeeded:
+            print(f"\nFailed to re-record {Path(result.cassette.path).name}:")
+            print(result.output)
+    print()
+    print(format_report(results))
+    return 0 if all(result.succeeded for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import threading
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from vcr.cassette import Cassette
+from vcr.request import Request
+
+# request header under which tool calls record their place in the causal order
+SEQUENCE_HEADER = "vcr-langchain-sequence"
+# request headers under which the wall clock start and end times of each interaction
+# are recorded
+STARTED_HEADER = "vcr-langchain-started"
+ENDED_HEADER = "vcr-langchain-ended"
+# request header that marks interactions made from inside another recorded call, such
+# as the HTTP requests of a model call that's also recorded as a whole
+NESTED_HEADER = "vcr-langchain-nested"
+# headers that vcr-langchain records for itself, and which requests never send
+BOOKKEEPING_HEADERS = (SEQUENCE_HEADER, STARTED_HEADER, ENDED_HEADER, NESTED_HEADER)
+
+# position of the current asyncio task in the tree of tasks spawned under a cassette
+_lineage: ContextVar[Tuple[int, ...]] = ContextVar("vcr_langchain_lineage", default=())
+# set while the real tool is running, so that tasks it spawns internally (which won't
+# be spawned at all on replay) don't shift the lineage of tasks spawned after it
+_in_tool: ContextVar[bool] = ContextVar("vcr_langchain_in_tool", default=False)
+
+
+class SequenceTracker:
+    """
+    Assigns every tool call a key that is stable across record and replay.
+
+    The key is made up of the lineage of the asyncio task making the call, plus the
+    number of tool calls that lineage had made before. A task's lineage is its
+    parent's lineage plus the order in which the parent created it. Since tasks are
+    created in a deterministic order even when they complete in a nondeterministic
+    one, calls fanned out with `asyncio.gather` get the same keys on every run.
+    """
+
+    def __init__(self) -> None:
+        self.call_counts: Counter = Counter()
+        self.child_counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self.users = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.og_task_factory: Optional[Callable] = None
+
+    def assign_key(self, request: Request) -> None:
+        """
+        Key a call by its place in the causal order, unless it's nested in another.
+
+        Calls made from inside a patched call that's really running don't happen at
+        all when that call gets replayed, so they mustn't shift the keys of the calls
+        after them. They are matched in the order they were recorded instead.
+        """
+        if not _in_tool.get():
+            request.headers[SEQUENCE_HEADER] = self.next_key()
+
+    def next_key(self) -> str:
+        lineage = _lineage.get()
+        with self.lock:
+            count = self.call_counts[lineage]
+            self.call_counts[lineage] += 1
+        return ".".join(str(i) for i in (0, *lineage)) + f"#{count}"
+
+    def task_factory(
+        self, loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any
+    ) -> "asyncio.Future[Any]":
+        if _in_tool.get():
+            lineage_token = None
+        else:
+            parent = _lineage.get()
+            with self.lock:
+                child = self.child_counts[parent]
+                self.child_counts[parent] += 1
+            # tasks copy the current context when they are created, so this is what
+            # hands the new lineage down to the task
+            lineage_token = _lineage.set((*parent, child))
+        try:
+            if self.og_task_factory is not None:
+                return self.og_task_factory(loop, coro, **kwargs)
+            return asyncio.Task(coro, loop=loop, **kwargs)
+        finally:
+            if lineage_token is not None:
+                _lineage.reset(lineage_token)
+
+    def __enter__(self) -> None:
+        if self.users == 0:
+            try:
+                self.loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.loop = None
+            if self.loop is not None:
+                self.og_task_factory = self.loop.get_task_factory()
+                self.loop.set_task_factory(self.task_factory)
+        self.users += 1
+
+    def __exit__(self, *_: List[Any]) -> None:
+        self.users -= 1
+        if self.users == 0 and self.loop is not None:
+            self.loop.set_task_factory(self.og_task_factory)
+            self.loop = None
+            self.og_task_factory = None
+
+
+_trackers: "weakref.WeakKeyDictionary[Cassette, SequenceTracker]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_tracker(cassette: Cassette) -> SequenceTracker:
+    """Get the tracker shared by all tool patches of a cassette"""
+    if cassette not in _trackers:
+        _trackers[cassette] = SequenceTracker()
+    return _trackers[cassette]
+
+
+def in_tool() -> bool:
+    """Whether this is running inside a patched call that's being made for real"""
+    return _in_tool.get()
+
+
+@contextlib.contextmanager
+def running_tool() -> Iterator[None]:
+    token = _in_tool.set(True)
+    try:
+        yield
+    finally:
+        _in_tool.reset(token)
+
+
+def _request_headers(request: Request) -> Dict[str, Any]:
+    return {
+        k.lower(): v
+        for k, v in request.headers.items()
+        if k.lower() not in BOOKKEEPING_HEADERS
+    }
+
+
+def headers_without_bookkeeping(r1: Request, r2: Request) -> None:
+    """Drop-in replacement for the vcrpy headers matcher that ignores our own headers"""
+    h1 = _request_headers(r1)
+    h2 = _request_headers(r2)
+    if h1 != h2:
+        raise AssertionError("{} != {}".format(h1, h2))
+
+
+def play_response(cassette: Cassette, request: Request) -> Any:
+    """
+    Like `Cassette.play_response`, but prefers the response with the same sequence key.
+
+    Falls back to the first unplayed match, which is what cassettes recorded before
+    sequence keys existed rely on.
+    """
+    sequence = request.headers.get(SEQUENCE_HEADER)
+    # layered cassettes also hold interactions that aren't in their own data
+    get_interaction = getattr(cassette, "get_interaction", cassette.data.__getitem__)
+    candidates = [
+        index
+        for index, _ in cassette._responses(request)
+        if cassette.play_counts[index] == 0 or cassette.allow_playback_repeats
+    ]
+    chosen = next(
+        (
+            index
+            for index in candidates
+            if sequence is not None
+            and get_interaction(index)[0].headers.get(SEQUENCE_HEADER) == sequence
+        ),
+        candidates[0],
+    )
+    cassette.play_counts[chosen] += 1
+    return get_interaction(chosen)[1]
@@ -0,0 +1,316 @@
+"""
+Serve recorded HTTP responses to any process on this machine.
+
+Usage:
+
+    python -m vcr_langchain.server [--port PORT | --unix-socket PATH] CASSETTE_OR_DIR...
+
+The cassettes are loaded and indexed once, and every client that points its base URL
+at the server gets answered from them. This is meant for subprocesses started by
+agents, such as a `PythonREPL` child or a bash script calling the OpenAI CLI, which
+can't see the cassette of the test that started them. While a cassette is in use,
+requests made by the test process itself are still answered by that cassette. For
+example, with the server on the default port:
+
+    export OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+
+Requests are matched by method, path, query and body, but not by host or headers.
+When several recorded responses match, the first one is always served, because the
+server can't tell which of its many clients is asking.
+
+Test processes, such as pytest-xdist workers, can also load their cassettes from the
+server instead of parsing them themselves, by pointing `VCR_LANGCHAIN_REPLAY_SERVER`
+at it:
+
+    export VCR_LANGCHAIN_REPLAY_SERVER=http://127.0.0.1:8765
+
+The cassettes are then only read from disk once, by the server. Each worker still
+keeps its own copy of the cassettes that are in use, since requests are matched in
+the test process. Cassettes the server doesn't have, such as ones recorded after it
+started, are read from disk as usual, so restart the server after re-recording.
+"""
+import argparse
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from vcr.request import Request
+from vcr.serializers import compat
+
+from .compiled import CompiledCassettePersister, load_cassettes
+from .sqlite import from_json, to_json
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+# environment variable that makes the default VCR load cassettes from a replay server
+REPLAY_SERVER_ENV = "VCR_LANGCHAIN_REPLAY_SERVER"
+# path under which the server hands out whole cassettes, out of the way of any API
+CASSETTE_PATH = "/__vcr_langchain__/cassette"
+# headers that describe how the original response was transferred, rather than what
+# it contained
+_HOP_HEADERS = {"connection", "content-length", "transfer-encoding"}
+
+RequestKey = Tuple[str, str, str, bytes]
+
+
+def _canonical_body(body: Union[str, bytes, None]) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        # JSON bodies are compared by value, just like vcrpy's body matcher does
+        return json.dumps(json.loads(body), sort_keys=True).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        return body
+
+
+def get_request_key(method: str, uri: str, body: Union[str, bytes, None]) -> RequestKey:
+    parts = urlsplit(uri)
+    return method.upper(), parts.path or "/", parts.query, _canonical_body(body)
+
+
+class ReplayIndex:
+    """Every recorded HTTP response from a set of cassettes, indexed by request"""
+
+    def __init__(self) -> None:
+        self.responses: Dict[RequestKey, Dict[str, Any]] = {}
+        # every interaction of every cassette, by the cassette's absolute path
+        self.cassettes: Dict[str, Tuple[List[Request], List[Any]]] = {}
+
+    @classmethod
+    def load(cls, paths: Iterable[str]) -> "ReplayIndex":
+        index = cls()
+        for cassette, requests, responses in load_cassettes(paths):
+            index.cassettes[os.path.abspath(cassette)] = (requests, responses)
+            for request, response in zip(requests, responses):
+                # tool calls can't be served over HTTP
+                if isinstance(response, dict) and not request.uri.startswith("tool:"):
+                    key = get_request_key(request.method, request.uri, request.body)
+                    index.responses.setdefault(key, response)
+        return index
+
+    def lookup(
+        self, method: str, uri: str, body: Union[str, bytes, None]
+    ) -> Optional[Dict[str, Any]]:
+        return self.responses.get(get_request_key(method, uri, body))
+
+
+def _render_response(
+    response: Dict[str, Any]
+) -> Tuple[int, List[Tuple[str, str]], bytes]:
+    # httpx cassettes store the decoded content, and other clients store the raw body
+    # just as it was sent, which may still be compressed
+    skipped_headers = set(_HOP_HEADERS)
+    if "content" in response:
+        status = response.get("status_code", 200)
+        body = response["content"]
+        skipped_headers.add("content-encoding")
+    else:
+        status = response.get("status", {}).get("code", 200)
+        body = response.get("body", {}).get("string", b"")
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    headers = [
+        (name, value)
+        for name, values in (response.get("headers") or {}).items()
+        if name.lower() not in skipped_headers
+        for value in (values if isinstance(values, list) else [values])
+    ]
+    headers.append(("Content-Length", str(len(body))))
+    return status, headers, body
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    server: "ReplayServerMixin"  # type: ignore[assignment]
+    protocol_version = "HTTP/1.1"
+
+    def _send_error(self, message: str) -> None:
+        payload = json.dumps(
+            {"error": {"message": message, "type": "vcr_langchain_replay_miss"}}
+        ).encode("utf-8")
+        self._send(
+            404,
+            [
+                ("Content-Type", "application/json"),
+                ("Content-Length", str(len(payload))),
+            ],
+            payload,
+        )
+
+    def _send_cassette(self) -> None:
+        paths = parse_qs(urlsplit(self.path).query).get("path", [])
+        cassette = self.server.index.cassettes.get(paths[0]) if paths else None
+        if cassette is None:
+            self._send_error(f"No cassette at {paths[0] if paths else None}")
+            return
+        requests, responses = cassette
+        payload = to_json(
+            {"requests": [r._to_dict() for r in requests], "responses": responses}
+        ).encode("utf-8")
+        self._send(
+            200,
+            [
+                ("Content-Type", "application/json"),
+                ("Content-Length", str(len(payload))),
+            ],
+            payload,
+        )
+
+    def _replay(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.command == "GET" and urlsplit(self.path).path == CASSETTE_PATH:
+            self._send_cassette()
+            return
+        response = self.server.index.lookup(self.command, self.path, body)
+        if response is None:
+            log.info("No recorded response for %s %s", self.command, self.path)
+            self._send_error(f"No recorded response for {self.command} {self.path}")
+        else:
+            self._send(*_render_response(response))
+
+    def _send(
+        self, status: int, headers: List[Tuple[str, str]], payload: bytes
+    ) -> None:
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _replay
+
+    def address_string(self) -> str:
+        # unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug(format, *args)
+
+
+class ReplayServerMixin:
+    index: ReplayIndex
+
+
+class TCPReplayServer(ReplayServerMixin, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixReplayServer(
+    ReplayServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+class ReplayServerPersister:
+    """
+    Persister that loads cassettes from a replay server instead of parsing them.
+
+    Cassettes that the server doesn't have are loaded from disk instead, and new
+    recordings are always saved to disk.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def load_cassette(
+        self, cassette_path: Union[str, Path], serializer: Any
+    ) -> Tuple[List[Request], List[Any]]:
+        query = urlencode({"path": os.path.abspath(cassette_path)})
+        try:
+            with urllib.request.urlopen(f"{self.url}{CASSETTE_PATH}?{query}") as f:
+                cassette = from_json(f.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+            return CompiledCassettePersister.load_cassette(cassette_path, serializer)
+        return (
+            [Request._from_dict(request) for request in cassette["requests"]],
+            [compat.convert_to_bytes(response) for response in cassette["responses"]],
+        )
+
+    def save_cassette(
+        self,
+        cassette_path: Union[str, Path],
+        cassette_dict: Dict[str, Any],
+        serializer: Any,
+    ) -> None:
+        CompiledCassettePersister.save_cassette(
+            cassette_path, cassette_dict, serializer
+        )
+
+
+def make_server(
+    index: ReplayIndex,
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    unix_socket: Optional[str] = None,
+) -> Union[TCPReplayServer, UnixReplayServer]:
+    server: Union[TCPReplayServer, UnixReplayServer]
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixReplayServer(unix_socket, ReplayRequestHandler)
+    else:
+        server = TCPReplayServer((host, port), ReplayRequestHandler)
+    server.index = index
+    return server
+
+
+def start_replay_server(
+    paths: Iterable[str], host: str = "127.0.0.1", port: int = 0
+) -> Tuple[TCPReplayServer, str]:
+    """
+    Serve the given cassettes from a background thread in this process.
+
+    Returns the server, so that it can be shut down, and its base URL.
+    """
+    server = make_server(ReplayIndex.load(paths), host=host, port=port)
+    assert isinstance(server, TCPReplayServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    bound_host, bound_port = server.server_address[:2]
+    return server, f"http://{bound_host!s}:{bound_port}"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vcr_langchain.server",
+        description="Serve recorded responses to every process on this machine.",
+    )
+    parser.add_argument("paths", nargs="+", help="cassettes or directories of them")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", help="listen on this socket instead of TCP")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    index = ReplayIndex.load(args.paths)
+    server = make_server(index, args.host, args.port, args.unix_socket)
+    if args.unix_socket:
+        print(f"Serving {len(index.responses)} responses on {args.unix_socket}")
+    else:
+        print(f"Serving {len(index.responses)} responses on {args.host}:{args.port}")
+        print(f"export OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+        print(f"export {REPLAY_SERVER_ENV}=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Keep every cassette in one SQLite database instead of one YAML file each.
+
+Usage:
+
+    python -m vcr_langchain.sqlite import DATABASE CASSETTE_OR_DIR...
+    python -m vcr_langchain.sqlite export DATABASE [--output-dir DIR]
+
+To have `vcr_langchain.use_cassette` read and write the database, point the
+`VCR_LANGCHAIN_DATABASE` environment variable at it. Cassettes are named by their path
+relative to the directory the database is in, so `tests/test_chatgpt.yaml` is imported
+from and exported back to the same place in the repository.
+
+The database runs in WAL mode, so any number of readers and pytest-xdist workers can
+use it at once. Each cassette is saved in its own transaction.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from vcr.persisters.filesystem import FilesystemPersister
+from vcr.request import Request
+from vcr.serializers import compat, yamlserializer
+
+from .compiled import load_cassettes
+
+log = logging.getLogger(__name__)
+
+# environment variable that makes the default VCR store cassettes in this database
+DATABASE_ENV = "VCR_LANGCHAIN_DATABASE"
+# how long a writer waits for another one to finish before giving up
+BUSY_TIMEOUT_SECONDS = 60.0
+# key of the JSON objects that stand in for bytes
+BYTES_TAG = "__bytes__"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    cassette TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    method TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    request TEXT NOT NULL,
+    response TEXT NOT NULL,
+    PRIMARY KEY (cassette, position)
+);
+CREATE INDEX IF NOT EXISTS interactions_by_fingerprint
+    ON interactions (fingerprint);
+"""
+
+
+def _encode_bytes(value: Any) -> Dict[str, str]:
+    # bodies that aren't text, such as gzipped ones, are kept as tagged base64
+    if isinstance(value, bytes):
+        return {BYTES_TAG: base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_bytes(value: Dict[str, Any]) -> Any:
+    if len(value) == 1 and BYTES_TAG in value:
+        return base64.b64decode(value[BYTES_TAG])
+    return value
+
+
+def to_json(value: Any) -> str:
+    """Encode cassette data as JSON, with any bytes that aren't text as base64"""
+    return json.dumps(compat.convert_to_unicode(value), default=_encode_bytes)
+
+
+def from_json(value: str) -> Any:
+    return json.loads(value, object_hook=_decode_bytes)
+
+
+def get_fingerprint(request: Request) -> str:
+    """Identify a request by its method, URI and body, the same way across cassettes"""
+    body = request.body
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True)
+    except (TypeError, ValueError):
+        pass
+    key = json.dumps([request.method, request.uri, body])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class SQLitePersister:
+    """
+    Persister that stores cassettes as rows of a single SQLite database.
+
+    Each interaction is a row keyed by its cassette's name and its position in the
+    cassette, so loading a cassette only reads that cassette's rows. Rows are also
+    indexed by request fingerprint, to find every cassette that recorded a request:
+
+        SELECT cassette FROM interactions WHERE fingerprint = ?
+
+    Requests and responses are stored as JSON, whatever serializer the VCR is set up
+    with. Bodies that aren't UTF-8 are stored as `{"__bytes__": "<base64>"}`.
+    """
+
+    def __init__(self, database: Union[str, Path]):
+        self.database = Path(database).absolute()
+        self._local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        # connections can't be shared across threads, or across forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            self.database.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                self.database, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_name(self, cassette_path: Union[str, Path]) -> str:
+        path = os.path.relpath(os.path.abspath(cassette_path), self.database.parent)
+        return Path(path).as_posix()
+
+    def cassette_names(self) -> List[str]:
+        rows = self.connect().execute(
+            "SELECT DISTINCT cassette FROM interactions ORDER BY cassette"
+        )
+        return [name for (name,) in rows]
+
+    def load_cassette(
+        self, cassette_path: Union[str, Path], serializer: Any
+    ) -> Tuple[List[Request], List[Any]]:
+        rows = self.connect().execute(
+            "SELECT request, response FROM interactions WHERE cassette = ? "
+            "ORDER BY position",
+            (self.get_name(cassette_path),),
+        )
+        requests, responses = [], []
+        for request, response in rows:
+            requests.append(Request._from_dict(from_json(request)))
+            responses.append(compat.convert_to_bytes(from_json(response)))
+        if not requests:
+            raise ValueError("Cassette not found.")
+        return requests, responses
+
+    def save_cassette(
+        self,
+        cassette_path: Union[str, Path],
+        cassette_dict: Dict[str, Any],
+        serializer: Any,
+    ) -> None:
+        name = self.get_name(cassette_path)
+        rows = [
+            (
+                name,
+                position,
+                get_fingerprint(request),
+                request.method,
+                request.uri,
+                to_json(request._to_dict()),
+                to_json(response),
+            )
+            for position, (request, response) in enumerate(
+                zip(cassette_dict["requests"], cassette_dict["responses"])
+            )
+        ]
+        connection = self.connect()
+        # take the write lock up front, so that concurrent writers queue up instead of
+        # failing to upgrade their read transactions
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM interactions WHERE cassette = ?", (name,))
+            connection.executemany(
+                "INSERT INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+def import_cassettes(persister: SQLitePersister, paths: Iterable[str]) -> int:
+    """Copy YAML cassettes into the database, replacing any with the same names"""
+    count = 0
+    for cassette_path, requests, responses in load_cassettes(
+        paths, FilesystemPersister
+    ):
+        persister.save_cassette(
+            cassette_path,
+            {"requests": requests, "responses": responses},
+            yamlserializer,
+        )
+        count += 1
+    return count
+
+
+def export_cassettes(
+    persister: SQLitePersister, output_dir: Optional[Union[str, Path]] = None
+) -> int:
+    """Write every cassette in the database out as YAML, under its original name"""
+    output_dir = Path(output_dir) if output_dir else persister.database.parent
+    names = persister.cassette_names()
+    for name in names:
+        requests, responses = persister.load_cassette(
+            persister.database.parent / name, yamlserializer
+        )
+        FilesystemPersister.save_cassette(
+            output_dir / name,
+            {"requests": requests, "responses": responses},
+            yamlserializer,
+        )
+    return len(names)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m vcr_langchain.sqlite",
+        description="Move cassettes between YAML files and a SQLite database.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="copy YAML cassettes in")
+    import_parser.add_argument("database")
+    import_parser.add_argument("paths", nargs="+", help="cassettes or directories")
+    export_parser = commands.add_parser("export", help="write cassettes out as YAML")
+    export_parser.add_argument("database")
+    export_parser.add_argument(
+        "--output-dir", help="directory to export under, instead of the database's"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    persister = SQLitePersister(args.database)
+    if args.command == "import":
+        count = import_cassettes(persister, args.paths)
+        print(f"Imported {count} cassettes into {args.database}")
+    else:
+        count = export_cassettes(persister, args.output_dir)
+        print(f"Exported {count} cassettes from {args.database}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
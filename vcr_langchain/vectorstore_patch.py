@@ -0,0 +1,358 @@
+import base64
+import hashlib
+import json
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.faiss import FAISS, dependable_faiss_import
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from vcr.cassette import Cassette
+from vcr.request import Request
+
+from .generic import GenericPatch
+
+# arguments that only affect tracing, and not the documents that get retrieved
+RETRIEVER_BLACKLISTED_ARGS = ["callbacks", "tags", "metadata", "run_name"]
+
+
+def serialize_document(document: Document) -> Dict[str, Any]:
+    return {"page_content": document.page_content, "metadata": document.metadata}
+
+
+def deserialize_document(serialized: Dict[str, Any]) -> Document:
+    return Document(**serialized)
+
+
+# digests of the stores searched so far, along with how many vectors they had then
+_digests: "weakref.WeakKeyDictionary[FAISS, Tuple[int, str]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_documents(store: FAISS) -> List[Tuple[str, Document]]:
+    """The ID and document of every vector in the store, in index order"""
+    documents = []
+    for i in range(store.index.ntotal):
+        docstore_id = store.index_to_docstore_id[i]
+        document = store.docstore.search(docstore_id)
+        if not isinstance(document, Document):
+            raise ValueError(f"Could not find document for id {docstore_id}")
+        documents.append((docstore_id, document))
+    return documents
+
+
+def get_digest(store: FAISS) -> str:
+    """
+    Fingerprint the documents in a store, so that searches of different stores with the
+    same number of vectors don't get mixed up. Document IDs are left out, because they
+    are random unless given explicitly.
+
+    The digest is cached until the number of vectors changes, so that only the first
+    search of a store has to go through all of its documents.
+    """
+    ntotal = store.index.ntotal
+    cached = _digests.get(store)
+    if cached is not None and cached[0] == ntotal:
+        return cached[1]
+    digest = hashlib.sha256()
+    for _, document in get_documents(store):
+        serialized = serialize_document(document)
+        digest.update(json.dumps(serialized, sort_keys=True, default=str).encode())
+    _digests[store] = (ntotal, digest.hexdigest())
+    return digest.hexdigest()
+
+
+class FAISSFromTextsPatchMixin(GenericPatch):
+    """
+    Records a snapshot of the index built by `FAISS.from_texts`.
+
+    Replaying the snapshot skips both embedding every text and building the index. The
+    snapshot is the index as serialized by faiss, along with the documents as JSON.
+    """
+
+    # cassettes recorded before this patch existed replay from the embedding requests
+    passes_through_misses = True
+
+    def __init__(self, cassette: Cassette, fn_name: str):
+        super().__init__(
+            cassette, FAISS, fn_name, blacklisted_args=["embedding", "run_manager"]
+        )
+
+    def get_request(self, og_self: Any, kwargs: Dict[str, Any]) -> Request:
+        request = super().get_request(og_self, kwargs)
+        # an index built with different embeddings can't be reused
+        request.headers["embedding"] = type(kwargs["embedding"]).__name__
+        return request
+
+    def serialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], response: FAISS
+    ) -> Dict[str, Any]:
+        faiss = dependable_faiss_import()
+        index = faiss.serialize_index(response.index).tobytes()
+        return {
+            "index": base64.b64encode(index).decode("ascii"),
+            "documents": [
+                {"id": docstore_id, **serialize_document(document)}
+                for docstore_id, document in get_documents(response)
+            ],
+        }
+
+    def deserialize_response(
+        self,
+        og_self: Type[FAISS],
+        kwargs: Dict[str, Any],
+        cached_response: Dict[str, Any],
+    ) -> FAISS:
+        faiss = dependable_faiss_import()
+        index = faiss.deserialize_index(
+            np.frombuffer(base64.b64decode(cached_response["index"]), dtype=np.uint8)
+        )
+        documents = cached_response["documents"]
+        docstore = InMemoryDocstore(
+            {
+                document["id"]: Document(
+                    page_content=document["page_content"],
+                    metadata=document["metadata"],
+                )
+                for document in documents
+            }
+        )
+        extra_kwargs = {
+            k: v
+            for k, v in kwargs.items()
+            if k not in ("texts", "embedding", "metadatas", "ids")
+        }
+        return og_self(
+            kwargs["embedding"],
+            index,
+            docstore,
+            {i: document["id"] for i, document in enumerate(documents)},
+            **extra_kwargs,
+        )
+
+
+class FAISSFromTextsPatch(FAISSFromTextsPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "from_texts")
+
+    def get_same_signature_override(self) -> Callable:
+        def from_texts(
+            cls: Type[FAISS],
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+        ) -> FAISS:
+            return self.generic_override(
+                cls,
+                texts=texts,
+                embedding=embedding,
+                metadatas=metadatas,
+                ids=ids,
+                **kwargs,
+            )
+
+        return from_texts
+
+
+class FAISSAsyncFromTextsPatch(FAISSFromTextsPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "afrom_texts")
+
+    def get_same_signature_override(self) -> Callable:
+        async def afrom_texts(
+            cls: Type[FAISS],
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+        ) -> FAISS:
+            return await self.generic_override(
+                cls,
+                texts=texts,
+                embedding=embedding,
+                metadatas=metadatas,
+                ids=ids,
+                **kwargs,
+            )
+
+        return afrom_texts
+
+
+class FAISSSearchPatchMixin(GenericPatch):
+    """
+    Records the results of searching a FAISS index.
+
+    `similarity_search` goes through `similarity_search_with_score`, so this covers
+    both of them without embedding the query on replay.
+    """
+
+    # cassettes recorded before this patch existed replay from the embedding requests
+    passes_through_misses = True
+
+    def __init__(self, cassette: Cassette, fn_name: str):
+        super().__init__(cassette, FAISS, fn_name)
+
+    def get_meta_information(self, og_self: Any) -> Dict[str, Any]:
+        return {
+            "embedding": type(og_self.embedding_function).__name__,
+            "ntotal": og_self.index.ntotal,
+            "documents": get_digest(og_self),
+        }
+
+    def serialize_response(
+        self,
+        og_self: Any,
+        kwargs: Dict[str, Any],
+        response: List[Tuple[Document, float]],
+    ) -> List[List[Any]]:
+        return [[serialize_document(doc), float(score)] for doc, score in response]
+
+    def deserialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], cached_response: List[List[Any]]
+    ) -> List[Tuple[Document, float]]:
+        return [(deserialize_document(doc), score) for doc, score in cached_response]
+
+
+class FAISSSearchPatch(FAISSSearchPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "similarity_search_with_score")
+
+    def get_same_signature_override(self) -> Callable:
+        def similarity_search_with_score(
+            og_self: FAISS,
+            query: str,
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            fetch_k: int = 20,
+            **kwargs: Any,
+        ) -> List[Tuple[Document, float]]:
+            return self.generic_override(
+                og_self, query=query, k=k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+
+        return similarity_search_with_score
+
+
+class FAISSAsyncSearchPatch(FAISSSearchPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "asimilarity_search_with_score")
+
+    def get_same_signature_override(self) -> Callable:
+        async def asimilarity_search_with_score(
+            og_self: FAISS,
+            query: str,
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            fetch_k: int = 20,
+            **kwargs: Any,
+        ) -> List[Tuple[Document, float]]:
+            return await self.generic_override(
+                og_self, query=query, k=k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+
+        return asimilarity_search_with_score
+
+
+class RetrieverPatchMixin(GenericPatch):
+    """Records the documents returned by any retriever"""
+
+    # cassettes recorded before this patch existed replay from the requests underneath
+    passes_through_misses = True
+
+    def __init__(self, cassette: Cassette, fn_name: str):
+        super().__init__(
+            cassette,
+            BaseRetriever,
+            fn_name,
+            blacklisted_args=RETRIEVER_BLACKLISTED_ARGS,
+        )
+
+    def get_meta_information(self, og_self: Any) -> Dict[str, Any]:
+        meta = {"retriever": type(og_self).__name__}
+        for attribute in ("search_type", "search_kwargs"):
+            if hasattr(og_self, attribute):
+                meta[attribute] = json.dumps(
+                    getattr(og_self, attribute), sort_keys=True, default=str
+                )
+        # retrievers over different stores can have the same configuration
+        vectorstore = getattr(og_self, "vectorstore", None)
+        if isinstance(vectorstore, FAISS):
+            meta["documents"] = get_digest(vectorstore)
+        return meta
+
+    def serialize_response(
+        self, og_self: Any, kwargs: Dict[str, Any], response: List[Document]
+    ) -> List[Dict[str, Any]]:
+        return [serialize_document(doc) for doc in response]
+
+    def deserialize_response(
+        self,
+        og_self: Any,
+        kwargs: Dict[str, Any],
+        cached_response: List[Dict[str, Any]],
+    ) -> List[Document]:
+        return [deserialize_document(doc) for doc in cached_response]
+
+
+class RetrieverPatch(RetrieverPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "get_relevant_documents")
+
+    def get_same_signature_override(self) -> Callable:
+        def get_relevant_documents(
+            og_self: BaseRetriever,
+            query: str,
+            *,
+            callbacks: Callbacks = None,
+            tags: Optional[List[str]] = None,
+            metadata: Optional[Dict[str, Any]] = None,
+            run_name: Optional[str] = None,
+            **kwargs: Any,
+        ) -> List[Document]:
+            return self.generic_override(
+                og_self,
+                query=query,
+                callbacks=callbacks,
+                tags=tags,
+                metadata=metadata,
+                run_name=run_name,
+                **kwargs,
+            )
+
+        return get_relevant_documents
+
+
+class RetrieverAsyncPatch(RetrieverPatchMixin):
+    def __init__(self, cassette: Cassette):
+        super().__init__(cassette, "aget_relevant_documents")
+
+    def get_same_signature_override(self) -> Callable:
+        async def aget_relevant_documents(
+            og_self: BaseRetriever,
+            query: str,
+            *,
+            callbacks: Callbacks = None,
+            tags: Optional[List[str]] = None,
+            metadata: Optional[Dict[str, Any]] = None,
+            run_name: Optional[str] = None,
+            **kwargs: Any,
+        ) -> List[Document]:
+            return await self.generic_override(
+                og_self,
+                query=query,
+                callbacks=callbacks,
+                tags=tags,
+                metadata=metadata,
+                run_name=run_name,
+                **kwargs,
+            )
+
+        return aget_relevant_documents